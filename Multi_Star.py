@@ -1,14 +1,31 @@
 import streamlit as st
 import datetime
+import functools
+
+import instrument
+import jobs
 
 from utils import vspace
 from utils import is_numeric
 from utils import read_data
 from utils import Observability
+from utils import Observability_Range
+from utils import MAX_RANGE_NIGHTS
+from utils import MAX_WORKERS
 from utils import Coordinates
+from utils import ENGINES
+from utils import format_times
+from utils import export_file
 from utils import pd
 from utils import u
 
+# rows of a page of the preview, only the shown page is formatted and sent
+# to the browser
+PAGE_ROWS = 100
+
+# seconds between two updates of the progress of a background calculation
+JOB_POLL_SECONDS = 0.5
+
 st.markdown(
     "<h2 style='text-align: center; margin-top: -50px;'>"
     "Multi Star Calculator"
@@ -31,7 +48,16 @@ with container:
         long = st.text_input("Enter your longitude in signed Decimal Degree format", key="long")
 
     with cols[2]: 
-        date=st.date_input("Select observation date")
+        date_range=st.checkbox("Date range", key="date_range",
+                               help=f"Visibility for every night of a range of up to {MAX_RANGE_NIGHTS} nights")
+
+        if date_range:
+            today=datetime.date.today()
+            dates=st.date_input("Select observation dates", value=(today, today+datetime.timedelta(days=7)),
+                                key="dates")
+            date=dates[0] if dates else today
+        else:
+            date=st.date_input("Select observation date")
 
     with cols[0]:
 
@@ -80,12 +106,19 @@ with container:
 
     with cols[0]:  # Second column for file uploader
         
-        uploaded_file = st.file_uploader("Upload your star catalog file", type=["csv", "txt", "dat"])
+        uploaded_file = st.file_uploader("Upload your star catalog file", type=["csv", "txt", "dat", "parquet", "feather", "arrow", "fits", "fit"])
 
         if uploaded_file is not None:
             try:
 
-                Data = read_data(uploaded_file)
+                # the catalog is read once per file, the spans of the read are
+                # only recorded when it is not served from the cache
+                with instrument.Recorder(trace_memory=st.session_state.get("perf", False)) as recorder:
+                    Data = read_data(uploaded_file)
+
+                if recorder.spans:
+                    st.session_state["read_spans"] = recorder.spans
+
                 st.session_state["Data"] = Data
                 st.success("File Loaded Successfully", width=315)
 
@@ -116,6 +149,107 @@ with container:
 
                 st.dataframe(Data, height=210)
 
+#Calculation of a background job: the observability for one night, or for
+#every night of a range of two dates. The first rows are kept in the job for
+#the page while the rest of the catalog is computed
+
+def calculate(job, Data, utc_shift, dates, Loc, timezone_local, engine, chunk_size, step,
+              tolerance, workers, mag_limit, min_duration, perf):
+
+    shown = []
+
+    def progress(Block, done):
+
+        job.report(done)
+
+        if sum(len(Rows) for Rows in shown) < PAGE_ROWS and len(Block):
+            shown.append(Block)
+            job.preview = pd.concat(shown).head(PAGE_ROWS)
+
+    with instrument.Recorder(trace_memory=perf) as recorder:
+
+        if len(dates) == 2:
+
+            Visibility_Index = None
+
+            Star_Observability = Observability_Range(Data, utc_shift, dates[0], dates[1], Loc,
+                                                     timezone_local, engine=engine,
+                                                     chunk_size=chunk_size, step=step,
+                                                     tolerance=tolerance, workers=workers,
+                                                     mag_limit=mag_limit, min_duration=min_duration,
+                                                     progress=progress)
+
+        else:
+
+            Star_Observability, Visibility_Index = Observability(Data, utc_shift, dates[0], Loc,
+                                                                 timezone_local, engine=engine,
+                                                                 chunk_size=chunk_size, step=step,
+                                                                 tolerance=tolerance, workers=workers,
+                                                                 mag_limit=mag_limit,
+                                                                 min_duration=min_duration,
+                                                                 progress=progress, intervals=True)
+
+    return Star_Observability, Visibility_Index, recorder.spans if perf else None
+
+#Progress of the background job, polled without rerunning the whole page.
+#Once the job has finished its result is stored and the page is redrawn
+
+@st.fragment(run_every=JOB_POLL_SECONDS)
+def job_status():
+
+    job = st.session_state.get("job")
+
+    if job is None:
+        return
+
+    if job.state() != "finished":
+
+        if job.cancelled.is_set():
+            st.progress(job.done, text="Cancelling...")
+        elif job.state() == "queued":
+            st.progress(0.0, text="Waiting for a free worker...")
+        else:
+            st.progress(job.done, text=f"Calculating... {job.done:.0%} of the stars")
+
+        if job.preview is not None:
+            st.dataframe(format_times(job.preview), height=212, width=360)
+
+        if st.button("Cancel", key="cancel_job", disabled=job.cancelled.is_set()):
+            job.cancel()
+
+        return
+
+    del st.session_state["job"]
+
+    try:
+
+        Star_Observability, Visibility_Index, spans = job.result()
+
+    except jobs.Cancelled:
+        pass
+
+    except Exception as e:
+        st.session_state["calculation_done"] = False
+        st.session_state["calculation_error"] = f"{e}"
+
+    else:
+
+        if spans is not None:
+            st.session_state["spans"] = st.session_state.get("read_spans", []) + spans
+
+        # store result for later preview, the filters are
+        # applied by the calculation
+        st.session_state["Star_Observability"] = Star_Observability
+        st.session_state["Filtered_Observability"] = Star_Observability
+        st.session_state["Visibility_Index"] = Visibility_Index
+        st.session_state["calculation_done"] = True
+
+        # the page widget may already exist in this run, it is reset by the
+        # full run that follows, before the widget is created
+        st.session_state["reset_page"] = True
+
+    st.rerun()
+
 preview_container=st.container()
 
 with preview_container:
@@ -149,55 +283,158 @@ with preview_container:
                 vspace()
 
         with pcols[0]:
-                
-                if st.button('Calculate the time of observability'):
-                    
-                    try:
-                        
-                        Star_Observability = Observability(
-                            st.session_state["Data"],
-                            utc_shift,
-                            date,
-                            st.session_state["Loc"],
-                            st.session_state["timezone_local"]
-                        )
-
-                        # store result for later preview
-                        st.session_state["Star_Observability"] = Star_Observability
-
-                        # Apply filters
-                        filtered_data = Star_Observability.copy()
-                        if 'Visibility (min)' in Star_Observability.columns and dur is not None:
-                            filtered_data = filtered_data[filtered_data['Visibility (min)'] > (dur*60)]
-
-                        if magn is not None and 'mag' in Star_Observability.columns:
-                            
-                            mag_numeric = pd.to_numeric(filtered_data['mag'], errors='coerce')
-                            filtered_data = filtered_data[mag_numeric.isna() | (mag_numeric < magn)]
-
-                        st.session_state["Filtered_Observability"] = filtered_data
-                        st.session_state["calculation_done"] = True
-
-                        with pcols[1]:
-
-                            if checkbox:
-                                vspace(17) 
-                                with st.expander("Observability preview", expanded=False, width=360):
-                                    st.dataframe(filtered_data, height=212)
-
-                                with pcols[2]:
-                                    vspace(18) 
-                                    total=len(filtered_data['star name'])
-                                    st.write("Total Number of Output Data : "+ str(total))
-                            else:
-                                vspace(8) 
-                                with st.expander("Observability preview", expanded=False, width=360):
-                                    st.dataframe(Star_Observability, height=212)
-
-                                with pcols[2]:
-                                    vspace(9) 
-                                    total=len(Star_Observability['star name'])
-                                    st.write("Total Number of Output Data : "+ str(total))
-
-                    except Exception as e:
-                        st.error(f'{e}')
+
+            engine=st.selectbox('Computation engine', ENGINES, key="engine",
+                                help="astropy: full ICRS to AltAz transformation. "
+                                     "fast: hour angle/declination broadcast, reports "
+                                     "its maximum altitude error against astropy.")
+
+            chunk_size=st.number_input('Stars per chunk', min_value=100, value=5000, step=1000,
+                                       key="chunk_size",
+                                       help="The catalog is evaluated in chunks of this many stars, "
+                                            "smaller chunks lower the peak memory.")
+
+            workers=st.number_input('Worker processes', min_value=1, max_value=MAX_WORKERS, value=1,
+                                    key="workers",
+                                    help="Compute this many chunks of the catalog at once, in the "
+                                         "worker processes shared by all the sessions.")
+
+            step_col, tol_col = st.columns(2)
+
+            with step_col:
+                step=st.number_input('Time step (min)', min_value=0.5, value=5.0, step=1.0, key="step")
+
+            with tol_col:
+                tolerance=st.number_input('Rise/set tolerance (min)', min_value=0.01, value=None,
+                                          key="tolerance",
+                                          help="Refine the rise/set times inside the time steps "
+                                               "to this precision. Leave empty for the grid precision.")
+
+            perf=st.checkbox('Performance details', key="perf",
+                             help="Time, memory and rows of every stage of the calculation. "
+                                  "Memory tracing slows the calculation down.")
+
+        with pcols[0]:
+
+            job = st.session_state.get("job")
+
+            # the calculation runs in the background, the page can rerun
+            # (and the filters change) while it is computed
+            if st.button('Calculate the time of observability',
+                         disabled=job is not None and job.state() != "finished"):
+
+                st.session_state["job"] = jobs.Job(
+                    calculate,
+                    Data=st.session_state["Data"],
+                    utc_shift=utc_shift,
+                    dates=dates if date_range and len(dates) == 2 else (date,),
+                    Loc=st.session_state["Loc"],
+                    timezone_local=st.session_state["timezone_local"],
+                    engine=engine,
+                    chunk_size=chunk_size,
+                    step=step,
+                    tolerance=tolerance,
+                    workers=workers,
+                    mag_limit=magn,
+                    min_duration=None if dur is None else dur*60,
+                    perf=perf
+                )
+                st.session_state.pop("calculation_error", None)
+
+            if "calculation_error" in st.session_state:
+                st.error(st.session_state["calculation_error"])
+
+        if "job" in st.session_state:
+
+            with pcols[1]:
+                vspace(17 if checkbox else 8)
+                job_status()
+
+        if st.session_state.get("calculation_done"):
+
+            Star_Observability = st.session_state["Star_Observability"]
+
+            with pcols[0]:
+
+                if 'max_altitude_error' in Star_Observability.attrs:
+                    st.write("Max altitude error of the fast engine: "
+                             f"{Star_Observability.attrs['max_altitude_error']:.4f} deg")
+
+            total = len(Star_Observability)
+            pages = max(-(-total // PAGE_ROWS), 1)
+
+            if st.session_state.pop("reset_page", False):
+                st.session_state["page"] = 1
+
+            with pcols[1]:
+
+                vspace(17 if checkbox else 8)
+                with st.expander("Observability preview", expanded=False, width=360):
+
+                    page = st.number_input(f"Page (of {pages})", min_value=1, max_value=pages,
+                                           step=1, key="page")
+                    first = (min(page, pages) - 1)*PAGE_ROWS
+
+                    st.dataframe(format_times(Star_Observability.iloc[first:first+PAGE_ROWS]),
+                                 height=212)
+
+            with pcols[2]:
+                vspace(18 if checkbox else 9)
+                st.write("Total Number of Output Data : "+ str(total))
+
+                Visibility_Index = st.session_state.get("Visibility_Index")
+
+                if Visibility_Index is not None:
+
+                    # stars visible in a time window of the night, from the interval index
+                    time_base = pd.Timestamp(Star_Observability.attrs['time_base'])
+                    local_noon = time_base.tz_convert(Star_Observability.attrs['timezone']).tz_localize(None)
+
+                    window = st.slider("Visible between", min_value=local_noon.to_pydatetime(),
+                                       max_value=(local_noon + pd.Timedelta(hours=24)).to_pydatetime(),
+                                       value=((local_noon + pd.Timedelta(hours=11)).to_pydatetime(),
+                                              (local_noon + pd.Timedelta(hours=13)).to_pydatetime()),
+                                       step=datetime.timedelta(minutes=5), format="HH:mm",
+                                       key=f"window_{time_base}")
+
+                    a, b = ((pd.Timestamp(t).tz_localize(Star_Observability.attrs['timezone'], ambiguous=True,
+                                                         nonexistent="shift_forward")
+                             - time_base).total_seconds()/60 for t in window)
+
+                    rows = Visibility_Index.between(a, b)
+
+                    st.write(f"Stars visible in the window: {len(rows)}")
+
+                    with st.expander("Visible stars", expanded=False, width=360):
+                        st.dataframe(format_times(Star_Observability.iloc[rows[:PAGE_ROWS]]), height=212)
+
+                # the file is built only when the button is clicked, the
+                # filters of the calculation are already applied to the result
+                export_format = st.selectbox("Export format", ("CSV", "Parquet"), key="export_format")
+
+                window_only = Visibility_Index is not None and st.checkbox(
+                    "Only the stars visible in the window", key="export_window")
+
+                extension = export_format.lower()
+
+                st.download_button("Download the results",
+                                   functools.partial(export_file, Star_Observability, extension,
+                                                     rows if window_only else None),
+                                   file_name=f"observability.{extension}",
+                                   mime="text/csv" if extension == "csv" else "application/octet-stream")
+
+        with pcols[0]:
+
+            if perf and "spans" in st.session_state:
+
+                with st.expander("Performance details", expanded=False, width=360):
+
+                    spans = st.session_state["spans"]
+
+                    if spans:
+                        st.dataframe(pd.DataFrame(instrument.summary(spans)), hide_index=True)
+                    else:
+                        st.write("The last result was served from the cache, no stage was run.")
+
+                    st.download_button("Download spans (JSON)", instrument.to_json(spans),
+                                       file_name="performance_spans.json", mime="application/json")
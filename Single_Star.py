@@ -2,7 +2,7 @@ import streamlit as st
 
 from utils import vspace
 from utils import Coordinates
-from utils import Observability_Single
+from utils import Single_Star_Chart
 
 import datetime
 from utils import u
@@ -31,6 +31,13 @@ with container:
     with cols[2]: 
         date=st.date_input("Select observation date")
 
+        step=st.number_input('Time step (min)', min_value=0.5, value=5.0, step=1.0, key="step")
+
+        tolerance=st.number_input('Rise/set tolerance (min)', min_value=0.01, value=None,
+                                  key="tolerance",
+                                  help="Refine the rise/set times inside the time steps "
+                                       "to this precision. Leave empty for the grid precision.")
+
     with cols[0]:
 
         if lat and long:
@@ -88,7 +95,8 @@ with container:
 
     if lat and long and ra and dec:
 
-        Duration, formatted, fig= Observability_Single(float(ra), float(dec), utc_shift,date, Loc, timezone_local)
+        Duration, formatted, png, Curves = Single_Star_Chart(float(ra), float(dec), utc_shift_p, date,
+                                                             lat, long, step=step, tolerance=tolerance)
 
         with cols[0]:
 
@@ -98,6 +106,11 @@ with container:
 
         with cols[1]:
 
-            st.pyplot(fig)
+            # the light chart is drawn by the browser from fewer points
+            if st.toggle("Interactive chart", key="light_chart"):
+                st.line_chart(Curves, x='Time from noon [h]', y=['Sun', 'Star (daylight)', 'Star (night)'],
+                              y_label='Altitude [deg]', color=['#FFA500', '#FFB3B3', '#FF0000'])
+            else:
+                st.image(png, width="stretch")
 
 
@@ -0,0 +1,158 @@
+#Command line / batch entry point: visibility of a catalog for a site and a
+#range of dates, streamed to a CSV or Parquet file without Streamlit.
+#
+#python batch.py catalog.csv --lat 50.1 --lon 14.4 --start 2026-03-01 --end 2026-03-31 --out visibility.parquet
+#
+#Several sites at once, one row per site, night and star:
+#
+#python batch.py catalog.csv --site ondrejov=49.9,14.8 --site lasilla=-29.3,-70.7 --date 2026-03-01 --out sites.csv
+
+import argparse
+import datetime
+import sys
+import time
+
+import visibility
+from visibility import u
+
+#UTC shift of the site at local noon of the date
+
+def utc_shift_at(date, timezone_local):
+
+    noon = datetime.datetime.combine(date, datetime.time(12), tzinfo=timezone_local)
+
+    return noon.utcoffset().total_seconds()/3600*u.hour
+
+#Visibility of the catalog at every site, night by night. The frames of a
+#night hold all the sites (site by site)
+
+def sites_frames(Data, sites, args):
+
+    date = args.start
+
+    while date <= args.end:
+
+        site_rows = [(name, Loc, timezone_local, utc_shift_at(date, timezone_local))
+                     for name, Loc, timezone_local in sites]
+
+        Rows = visibility.Observability_Sites(Data, site_rows, date, args.engine, args.chunk_size,
+                                              args.step, args.tolerance, args.workers,
+                                              min_duration=args.min_duration)
+        Rows.insert(1, 'date', date.isoformat())
+
+        yield visibility.format_times(Rows)
+
+        date += datetime.timedelta(days=1)
+
+def parse_site(value):
+
+    name, _, position = value.partition("=")
+    lat, _, lon = position.partition(",")
+
+    if not name or not lat or not lon:
+        raise argparse.ArgumentTypeError(f"invalid site '{value}', use NAME=LAT,LON")
+
+    return name, lat, lon
+
+def parse_date(value):
+
+    try:
+        return datetime.date.fromisoformat(value)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"invalid date '{value}', use YYYY-MM-DD")
+
+def parse_args(argv=None):
+
+    parser = argparse.ArgumentParser(description="Visibility of the stars of a catalog for every "
+                                                 "night of a date range at one or several sites.")
+
+    parser.add_argument("catalog", help="star catalog (csv/txt/dat, Parquet, Arrow/Feather or FITS)")
+    parser.add_argument("--lat", help="latitude of the site in signed decimal degrees")
+    parser.add_argument("--lon", help="longitude of the site in signed decimal degrees")
+    parser.add_argument("--site", type=parse_site, action="append", dest="sites", metavar="NAME=LAT,LON",
+                        help="a named site instead of --lat/--lon, repeat it for several sites")
+    parser.add_argument("--date", type=parse_date, help="single night (same as --start DATE --end DATE)")
+    parser.add_argument("--start", type=parse_date, help="first night of the range")
+    parser.add_argument("--end", type=parse_date, help="last night of the range (default: --start)")
+    parser.add_argument("--out", required=True, help="output file (.csv or .parquet), '-' for CSV on stdout")
+    parser.add_argument("--format", choices=("csv", "parquet"),
+                        help="output format (default: from the extension of --out)")
+    parser.add_argument("--engine", choices=visibility.ENGINES, default="astropy")
+    parser.add_argument("--step", type=float, default=5, help="time step of the grid in minutes")
+    parser.add_argument("--tolerance", type=float, help="precision of the rise/set refinement in minutes")
+    parser.add_argument("--chunk-size", type=int, default=5000, help="stars evaluated at once")
+    parser.add_argument("--workers", type=int, help="parallel worker processes")
+    parser.add_argument("--mag-limit", type=float,
+                        help="only the stars brighter than this magnitude (stars without one are kept)")
+    parser.add_argument("--min-duration", type=float,
+                        help="only the nights a star is visible for longer than this, in minutes")
+
+    args = parser.parse_args(argv)
+
+    if args.sites and (args.lat or args.lon):
+        parser.error("use either --lat/--lon or --site")
+
+    if not args.sites and not (args.lat and args.lon):
+        parser.error("the site is needed, use --lat and --lon or --site NAME=LAT,LON")
+
+    args.start = args.start or args.date or datetime.date.today()
+    args.end = args.end or args.date or args.start
+
+    if args.format is None:
+        args.format = "parquet" if args.out.lower().endswith((".parquet", ".pq")) else "csv"
+
+    if args.format == "parquet" and args.out == "-":
+        parser.error("Parquet output needs a file, use --out PATH")
+
+    return args
+
+def main(argv=None):
+
+    args = parse_args(argv)
+
+    started = time.perf_counter()
+
+    try:
+        Data = visibility.read_data(args.catalog)
+
+        # magnitude cut before any coordinate work
+        Data = Data[visibility.magnitude_mask(Data, args.mag_limit)]
+
+        if args.sites:
+
+            sites = [(name, *visibility.Coordinates(lat, lon)[:2]) for name, lat, lon in args.sites]
+
+            nights = range((args.end - args.start).days + 1)
+            tz_string = f"{len(sites)} sites"
+
+            frames = sites_frames(Data, sites, args)
+
+        else:
+
+            Loc, timezone_local, tz_string = visibility.Coordinates(args.lat, args.lon)
+
+            utc_shift = utc_shift_at(args.start, timezone_local)
+
+            nights = visibility.Range_Nights(args.start, args.end, utc_shift, Loc, timezone_local,
+                                             args.step, args.tolerance)
+
+            # the start/end minutes are formatted as local times block by block
+            frames = (visibility.format_times(Rows)
+                      for first, Rows in visibility.iter_range_frames(Data, nights, args.start, Loc,
+                                                                      args.engine, args.chunk_size,
+                                                                      args.workers, args.min_duration))
+
+        rows = visibility.write_frames(frames, sys.stdout.buffer if args.out == "-" else args.out,
+                                       args.format)
+
+    except ValueError as e:
+        print(f"error: {e}", file=sys.stderr)
+        return 1
+
+    print(f"{len(Data)} stars x {len(nights)} nights ({tz_string}): {rows} rows written to "
+          f"{args.out} in {time.perf_counter() - started:.1f} s", file=sys.stderr)
+
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,175 @@
+#Time to first paint of the pages of the app: every page is run headless
+#(streamlit.testing) in a fresh process, so the imports and the process-wide
+#caches start cold. Reports the first run of the page, a rerun without
+#changes and the first run with a site entered (timezone lookup), the best
+#of --cold processes; the results are saved as JSON like the visibility
+#benchmarks.
+#
+#python benchmarks/bench_startup.py --out startup.json
+
+import argparse
+import datetime
+import json
+import os
+import subprocess
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+#Scripts of the app: (case, script), the entry script runs its default page
+PAGES = [
+    ("app", "Automated_Visibility_Catalog.py"),
+    ("Single_Star", "Single_Star.py"),
+    ("Multi_Star", "Multi_Star.py"),
+]
+
+#Site entered for the runs with a location
+SITE = ("50.1", "14.4")
+
+#Modules timed on their own import
+MODULES = ["visibility", "utils"]
+
+#Runs in the child process: one page (or module import), cold
+
+def measure_page(script, repeat):
+
+    import logging
+
+    from streamlit.testing.v1 import AppTest
+
+    logging.disable(logging.WARNING)
+
+    entry = {}
+
+    at = AppTest.from_file(os.path.join(ROOT, script), default_timeout=120)
+
+    started = time.perf_counter()
+    at.run()
+    entry["first_run_s"] = time.perf_counter() - started
+
+    reruns = []
+
+    for _ in range(max(repeat, 1)):
+        started = time.perf_counter()
+        at.run()
+        reruns.append(time.perf_counter() - started)
+
+    entry["rerun_s"] = min(reruns)
+
+    if at.text_input:
+        at.text_input(key="lat").input(SITE[0])
+        at.text_input(key="long").input(SITE[1])
+
+        started = time.perf_counter()
+        at.run()
+        entry["site_run_s"] = time.perf_counter() - started
+
+    entry["exceptions"] = len(at.exception)
+
+    return entry
+
+def measure_import(module):
+
+    started = time.perf_counter()
+    __import__(module)
+
+    return {"import_s": time.perf_counter() - started}
+
+def child(args):
+
+    sys.path.insert(0, ROOT)
+    os.chdir(ROOT)
+
+    if args.child_page:
+        entry = measure_page(args.child_page, args.repeat)
+    else:
+        entry = measure_import(args.child_module)
+
+    print(json.dumps({k: round(v, 6) if isinstance(v, float) else v for k, v in entry.items()}))
+
+#Best times of cold runs of the child, every run in a new process
+
+def spawn(cold, *options):
+
+    best = {}
+
+    for _ in range(max(cold, 1)):
+
+        output = subprocess.run([sys.executable, os.path.abspath(__file__), *options],
+                                capture_output=True, text=True, cwd=ROOT)
+
+        if output.returncode != 0:
+            return dict(status=f"error: {output.stderr.strip().splitlines()[-1:]}")
+
+        for k, v in json.loads(output.stdout.strip().splitlines()[-1]).items():
+            best[k] = min(best.get(k, v), v) if k.endswith("_s") else v
+
+    return dict(status="ok", **best)
+
+def run(args):
+
+    results = []
+
+    for module in MODULES:
+        results.append(dict(case="import", module=module, **spawn(args.cold, "--child-module", module)))
+        print(" ".join(f"{k}={v}" for k, v in results[-1].items()), flush=True)
+
+    for case, script in PAGES:
+        results.append(dict(case=case, **spawn(args.cold, "--child-page", script, "--repeat", str(args.repeat))))
+        print(" ".join(f"{k}={v}" for k, v in results[-1].items()), flush=True)
+
+    return results
+
+def environment():
+
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                                cwd=ROOT).stdout.strip()
+    except OSError:
+        commit = None
+
+    import platform
+    import streamlit
+
+    return dict(time=datetime.datetime.now().isoformat(timespec="seconds"), commit=commit,
+                python=platform.python_version(), platform=platform.platform(),
+                cpus=os.cpu_count(), streamlit=streamlit.__version__)
+
+def parse_args(argv=None):
+
+    parser = argparse.ArgumentParser(description="Time to first paint of the pages of the app.")
+
+    parser.add_argument("--cold", type=int, default=5, help="cold processes per case (best is kept)")
+    parser.add_argument("--repeat", type=int, default=3, help="timed reruns per page (best is kept)")
+    parser.add_argument("--out", help="JSON file of the results "
+                                      "(default: benchmarks/results/startup-<time>.json)")
+    parser.add_argument("--child-page", help=argparse.SUPPRESS)
+    parser.add_argument("--child-module", help=argparse.SUPPRESS)
+
+    return parser.parse_args(argv)
+
+def main(argv=None):
+
+    args = parse_args(argv)
+
+    if args.child_page or args.child_module:
+        child(args)
+        return 0
+
+    results = run(args)
+
+    out = args.out or os.path.join(ROOT, "benchmarks", "results",
+                                   f"startup-{datetime.datetime.now():%Y%m%d-%H%M%S}.json")
+
+    os.makedirs(os.path.dirname(os.path.abspath(out)), exist_ok=True)
+
+    with open(out, "w") as f:
+        json.dump(dict(environment=environment(), results=results), f, indent=1)
+
+    print(f"results written to {out}")
+
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
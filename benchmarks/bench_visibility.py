@@ -0,0 +1,253 @@
+#Benchmarks of read_data, Coordinates, Observability and Observability_Single
+#on synthetic catalogs, offline. Every case reports the wall time (best of
+#--repeat runs), the peak memory traced in a separate run and the throughput
+#in stars per second; the results are saved as JSON so runs can be compared.
+#
+#python benchmarks/bench_visibility.py --sizes 10,1000,100000 --out before.json
+#python benchmarks/bench_visibility.py --compare before.json after.json
+
+import argparse
+import datetime
+import gc
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy as np
+import pandas as pd
+
+# no downloads of Earth orientation data, the benchmarks run offline
+os.environ.setdefault("AVC_OFFLINE", "1")
+
+import result_cache
+import visibility
+from batch import utc_shift_at
+
+#Sites and nights of the benchmark: (name, latitude, longitude, date)
+SITES = [
+    ("equator", 0.0, 30.0, datetime.date(2026, 3, 20)),
+    ("mid-north", 50.1, 14.4, datetime.date(2026, 3, 1)),
+    ("south", -30.2, -70.7, datetime.date(2026, 3, 1)),
+    ("polar-summer", 65.0, 25.5, datetime.date(2026, 6, 21)),
+    ("midnight-sun", 69.6, 18.9, datetime.date(2026, 6, 21)),
+]
+
+#Time grids of the benchmark: (step in minutes, rise/set tolerance in minutes)
+GRIDS = [(5, None), (1, None), (15, 0.1)]
+
+#Catalog of n stars spread uniformly over the sky
+
+def synthetic_catalog(n, seed=0):
+
+    rng = np.random.default_rng(seed)
+
+    return pd.DataFrame({
+        'star_name': [f"star {i}" for i in range(n)],
+        'ra': rng.uniform(0, 360, n),
+        'dec': np.degrees(np.arcsin(rng.uniform(-1, 1, n))),
+        'mag_v': rng.uniform(-1, 15, n),
+    })
+
+#Best wall time of repeat runs of function, peak traced memory of one more run
+
+def measure(function, repeat=1):
+
+    wall = []
+
+    for _ in range(max(repeat, 1)):
+
+        gc.collect()
+        started = time.perf_counter()
+        function()
+        wall.append(time.perf_counter() - started)
+
+    gc.collect()
+    tracemalloc.start()
+
+    try:
+        function()
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+    return min(wall), peak
+
+def record(results, case, stars, function, repeat, **settings):
+
+    entry = dict(case=case, stars=stars, **settings)
+
+    try:
+        wall, peak = measure(function, repeat)
+
+        entry.update(status="ok", wall_s=round(wall, 6), peak_mb=round(peak/1024**2, 3),
+                     stars_per_s=round(stars/wall, 1) if wall > 0 else None)
+
+    except ValueError as e:
+        entry.update(status=f"error: {e}")
+
+    results.append(entry)
+
+    print(" ".join(f"{k}={v}" for k, v in entry.items()), flush=True)
+
+def run(args):
+
+    results = []
+
+    sites = [site for site in SITES if args.sites is None or site[0] in args.sites]
+    grids = [grid for grid in GRIDS if args.steps is None or grid[0] in args.steps]
+
+    with tempfile.TemporaryDirectory() as tmp:
+
+        for n in args.sizes:
+
+            catalog = synthetic_catalog(n)
+
+            csv_path = os.path.join(tmp, f"catalog_{n}.csv")
+            parquet_path = os.path.join(tmp, f"catalog_{n}.parquet")
+            catalog.to_csv(csv_path, index=False)
+            catalog.to_parquet(parquet_path)
+
+            record(results, "read_data", n, lambda: visibility.read_data(csv_path),
+                   args.repeat, format="csv")
+            record(results, "read_data", n, lambda: visibility.read_data(parquet_path),
+                   args.repeat, format="parquet")
+
+            Data = visibility.read_data(parquet_path)
+
+            for name, lat, lon, date in sites:
+
+                Loc, timezone_local, tz_string = visibility.Coordinates(lat, lon)
+                utc_shift = utc_shift_at(date, timezone_local)
+
+                for engine in args.engines:
+
+                    if engine == "astropy" and n > args.max_astropy_stars:
+                        continue
+
+                    for step, tolerance in grids:
+
+                        def observability():
+                            # cold sun cache, row memo and result cache, the solar work is
+                            # part of the case
+                            visibility.cached_night_grid.cache_clear()
+                            visibility.ROW_MEMO.clear()
+                            result_cache.MEMORY.clear()
+                            visibility.Observability(Data.copy(), utc_shift, date, Loc, timezone_local,
+                                                     engine=engine, chunk_size=args.chunk_size,
+                                                     step=step, tolerance=tolerance)
+
+                        record(results, "Observability", n, observability, args.repeat,
+                               site=name, lat=lat, date=str(date), engine=engine,
+                               step=step, tolerance=tolerance)
+
+    for name, lat, lon, date in sites:
+
+        record(results, "Coordinates", 1, lambda: visibility.Coordinates(lat, lon), args.repeat,
+               site=name, lat=lat)
+
+        Loc, timezone_local, tz_string = visibility.Coordinates(lat, lon)
+        utc_shift = utc_shift_at(date, timezone_local)
+
+        for step, tolerance in grids:
+
+            def single():
+                visibility.cached_night_grid.cache_clear()
+                visibility.Observability_Single(88.79, 7.41, utc_shift, date, Loc, timezone_local,
+                                                step=step, tolerance=tolerance)
+
+            record(results, "Observability_Single", 1, single, args.repeat,
+                   site=name, lat=lat, date=str(date), step=step, tolerance=tolerance)
+
+    return results
+
+def environment():
+
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                                cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except OSError:
+        commit = None
+
+    import astropy
+
+    return dict(time=datetime.datetime.now().isoformat(timespec="seconds"), commit=commit,
+                python=platform.python_version(), platform=platform.platform(),
+                cpus=os.cpu_count(), numpy=np.__version__, pandas=pd.__version__,
+                astropy=astropy.__version__)
+
+#Prints the wall time and peak memory ratios (new/old) of the cases of two runs
+
+def compare(old_path, new_path):
+
+    def cases(path):
+        with open(path) as f:
+            return {json.dumps({k: v for k, v in entry.items()
+                                if k not in ("status", "wall_s", "peak_mb", "stars_per_s")},
+                               sort_keys=True): entry
+                    for entry in json.load(f)["results"]}
+
+    old, new = cases(old_path), cases(new_path)
+
+    for key in sorted(old.keys() & new.keys()):
+
+        a, b = old[key], new[key]
+
+        if a["status"] != "ok" or b["status"] != "ok":
+            continue
+
+        print(f"{key}  time x{b['wall_s']/a['wall_s']:.2f}  "
+              f"memory x{b['peak_mb']/max(a['peak_mb'], 1e-9):.2f}")
+
+def parse_args(argv=None):
+
+    parser = argparse.ArgumentParser(description="Benchmarks of the visibility computation.")
+
+    parser.add_argument("--sizes", default="10,1000,100000,1000000",
+                        type=lambda s: [int(float(n)) for n in s.split(",")],
+                        help="catalog sizes (comma separated)")
+    parser.add_argument("--engines", default=",".join(visibility.ENGINES), type=lambda s: s.split(","))
+    parser.add_argument("--steps", type=lambda s: [float(n) for n in s.split(",")],
+                        help=f"only the grids with these steps (of {[step for step, _ in GRIDS]})")
+    parser.add_argument("--sites", type=lambda s: s.split(","),
+                        help=f"only these sites (of {[site[0] for site in SITES]})")
+    parser.add_argument("--max-astropy-stars", type=int, default=100000,
+                        help="largest catalog run with the astropy engine")
+    parser.add_argument("--chunk-size", type=int, default=5000)
+    parser.add_argument("--repeat", type=int, default=1, help="timed runs per case (best is kept)")
+    parser.add_argument("--out", help="JSON file of the results "
+                                      "(default: benchmarks/results/bench-<time>.json)")
+    parser.add_argument("--compare", nargs=2, metavar=("OLD", "NEW"), help="compare two result files")
+
+    return parser.parse_args(argv)
+
+def main(argv=None):
+
+    args = parse_args(argv)
+
+    if args.compare:
+        compare(*args.compare)
+        return 0
+
+    results = run(args)
+
+    out = args.out or os.path.join(os.path.dirname(os.path.abspath(__file__)), "results",
+                                   f"bench-{datetime.datetime.now():%Y%m%d-%H%M%S}.json")
+
+    os.makedirs(os.path.dirname(os.path.abspath(out)), exist_ok=True)
+
+    with open(out, "w") as f:
+        json.dump(dict(environment=environment(), results=results), f, indent=1)
+
+    print(f"results written to {out}")
+
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,70 @@
+#Earth orientation (IERS) data of astropy, needed by every AltAz/TETE transform
+#and by get_sun. By default astropy downloads a new IERS-A table when the
+#bundled one is too old for the requested dates, and the first calculation
+#of a process can stall on the download. In offline mode the bundled tables
+#(or a pre-fetched one) are used whatever their age and nothing is downloaded.
+#
+#AVC_OFFLINE=1 AVC_IERS_FILE=/data/finals2000A.all streamlit run Automated_Visibility_Catalog.py
+
+import os
+import threading
+
+from astropy.utils import iers
+
+from instrument import span
+
+#No downloads of Earth orientation data (or anything else from astropy)
+OFFLINE = os.environ.get("AVC_OFFLINE", "").strip().lower() in ("1", "true", "yes", "on")
+
+#Pre-fetched IERS-A table (finals2000A.all) used instead of the bundled one,
+#it turns the downloads off too
+IERS_FILE = os.environ.get("AVC_IERS_FILE")
+
+LOADED = False
+LOADED_LOCK = threading.Lock()
+
+def configure():
+
+    if OFFLINE or IERS_FILE:
+        iers.conf.auto_download = False
+
+    if OFFLINE:
+
+        from astropy.utils import data
+
+        data.conf.allow_internet = False
+
+        # dates past the end of the tables use predicted or mean values with
+        # a warning instead of an error
+        iers.conf.iers_degraded_accuracy = "warn"
+
+#Loads the Earth orientation table once per process, before the first
+#transform, so its parsing is not part of the first calculation
+
+def load():
+
+    global LOADED
+
+    with LOADED_LOCK:
+
+        if LOADED:
+            return
+
+        with span("earth orientation"):
+
+            if IERS_FILE:
+
+                try:
+                    table = iers.IERS_A.open(IERS_FILE)
+                except Exception:
+                    raise ValueError(f"The Earth orientation file '{IERS_FILE}' (AVC_IERS_FILE) "
+                                     "cannot be read")
+
+                iers.earth_orientation_table.set(table)
+
+            else:
+                iers.earth_orientation_table.get()
+
+        LOADED = True
+
+configure()
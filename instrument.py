@@ -0,0 +1,182 @@
+#Lightweight per-stage instrumentation. Stages are wrapped in span(name, rows),
+#which records nothing unless a Recorder is active in the thread, so the
+#spans cost almost nothing in normal runs. Every finished span is also
+#logged as one JSON line on the "avc.performance" logger
+
+import json
+import logging
+import threading
+import time
+import tracemalloc
+
+from contextlib import contextmanager
+
+logger = logging.getLogger("avc.performance")
+
+_local = threading.local()
+
+#tracemalloc is process-wide: it is started by the first recorder tracing
+#memory and stopped by the last one, and left alone when something else
+#started it. The memory of a span is only measured when its recorder was the
+#single one tracing memory from the start to the end of the span (the peak
+#of tracemalloc is reset by every span and the allocations of the other
+#threads would be counted too); otherwise the span has its duration and rows
+#only. TRACING counts the recorders which started tracing, so a recorder
+#coming and going during a span is noticed
+TRACERS = 0
+TRACING = 0
+TRACING_STARTED = False
+TRACE_LOCK = threading.Lock()
+
+#Number of the current tracing recorder when it is the single one, None if
+#there are several (or tracemalloc was started by something else)
+
+def exclusive_tracing():
+
+    with TRACE_LOCK:
+        return TRACING if TRACERS == 1 and TRACING_STARTED else None
+
+#Collects the spans of the stages run in this thread while it is active.
+#With trace_memory the memory allocated by every stage is traced with
+#tracemalloc, which slows the run down
+
+class Recorder:
+
+    def __init__(self, trace_memory=False):
+
+        self.spans = []
+        self.trace_memory = trace_memory
+        self.stack = []
+
+    def __enter__(self):
+
+        global TRACERS, TRACING, TRACING_STARTED
+
+        self.origin = time.perf_counter()
+        self.previous = getattr(_local, "recorder", None)
+        _local.recorder = self
+
+        if self.trace_memory:
+
+            with TRACE_LOCK:
+
+                if TRACERS == 0 and not tracemalloc.is_tracing():
+                    tracemalloc.start()
+                    TRACING_STARTED = True
+
+                TRACERS += 1
+                TRACING += 1
+
+        return self
+
+    def __exit__(self, *exc):
+
+        global TRACERS, TRACING_STARTED
+
+        _local.recorder = self.previous
+
+        if self.trace_memory:
+
+            with TRACE_LOCK:
+
+                TRACERS -= 1
+
+                if TRACERS == 0 and TRACING_STARTED:
+                    tracemalloc.stop()
+                    TRACING_STARTED = False
+
+    def summary(self):
+
+        return summary(self.spans)
+
+    def to_json(self):
+
+        return to_json(self.spans)
+
+#Duration, calls and rows of every stage, summed over its spans, with the
+#largest allocation and peak memory of the stage
+
+def summary(spans):
+
+    stages = {}
+
+    for span in spans:
+
+        stage = stages.setdefault(span["name"], dict(name=span["name"], calls=0, duration_s=0.0,
+                                                     rows=0, alloc_mb=None, peak_mb=None))
+        stage["calls"] += 1
+        stage["duration_s"] += span["duration_s"]
+        stage["rows"] += span["rows"] or 0
+
+        for key in ("alloc_mb", "peak_mb"):
+            if span[key] is not None:
+                stage[key] = span[key] if stage[key] is None else max(stage[key], span[key])
+
+    return list(stages.values())
+
+def to_json(spans):
+
+    return json.dumps(spans, indent=1)
+
+def current():
+
+    return getattr(_local, "recorder", None)
+
+#Keeps the peak memory seen by the innermost span of the stack, if it
+#measures memory
+
+def keep_peak(stack, peak):
+
+    if stack and "_peak" in stack[-1]:
+        stack[-1]["_peak"] = max(stack[-1]["_peak"], peak)
+
+#Records the duration, memory and row count of the stage run inside it.
+#The rows can also be set later through the returned dict
+
+@contextmanager
+def span(name, rows=None):
+
+    recorder = current()
+
+    if recorder is None:
+        yield {}
+        return
+
+    tracing = exclusive_tracing() if recorder.trace_memory else None
+
+    entry = dict(name=name, start_s=None, duration_s=None, rows=rows, alloc_mb=None, peak_mb=None,
+                 thread=threading.current_thread().name)
+
+    if tracing is not None:
+        # keep the peak of the enclosing span before resetting it for this one
+        before, peak = tracemalloc.get_traced_memory()
+        keep_peak(recorder.stack, peak)
+        tracemalloc.reset_peak()
+        entry["_peak"] = before
+
+    recorder.stack.append(entry)
+    started = time.perf_counter()
+
+    try:
+        yield entry
+
+    finally:
+        entry["start_s"] = round(started - recorder.origin, 6)
+        entry["duration_s"] = round(time.perf_counter() - started, 6)
+
+        recorder.stack.pop()
+
+        if tracing is not None and tracing == exclusive_tracing():
+            after, peak = tracemalloc.get_traced_memory()
+            peak = max(entry["_peak"], peak)
+            entry["alloc_mb"] = round((after - before)/1024**2, 3)
+            entry["peak_mb"] = round((peak - before)/1024**2, 3)
+
+            keep_peak(recorder.stack, peak)
+            tracemalloc.reset_peak()
+
+        entry.pop("_peak", None)
+
+        recorder.spans.append(entry)
+
+        logger.info(json.dumps(entry))
@@ -0,0 +1,121 @@
+#Index of the visibility intervals of the stars of one night, for "which stars
+#are visible at t / between a and b" queries. The intervals (in minutes from
+#local noon) are kept in a static centered interval tree: every node holds
+#the intervals containing its center, sorted by start and by end, so a query
+#visits O(log n) nodes and takes a contiguous slice of each
+
+import numpy as np
+
+class VisibilityIndex:
+
+    #rows[i] is the row (position in the result) of the star visible from
+    #start[i] to end[i]; a star can have several intervals
+
+    def __init__(self, rows, start, end):
+
+        self.rows = np.asarray(rows, dtype=np.int64)
+        self.start = np.asarray(start, dtype=np.float32)
+        self.end = np.asarray(end, dtype=np.float32)
+
+        self.nodes = []
+        self.root = self.build(np.arange(len(self.rows)))
+
+    def __len__(self):
+
+        return len(self.rows)
+
+    #Node: (center, intervals by start, their starts, intervals by end, their
+    #ends, left child, right child), -1 for no child. The center is the median
+    #of the endpoints, so both children hold fewer intervals than the node
+
+    def build(self, intervals):
+
+        if not len(intervals):
+            return -1
+
+        start, end = self.start[intervals], self.end[intervals]
+
+        center = float(np.median(np.concatenate((start, end))))
+
+        here = (start <= center) & (end >= center)
+
+        by_start = intervals[here][np.argsort(start[here], kind="stable")]
+        by_end = intervals[here][np.argsort(end[here], kind="stable")]
+
+        left = self.build(intervals[end < center])
+        right = self.build(intervals[start > center])
+
+        self.nodes.append((center, by_start, self.start[by_start], by_end, self.end[by_end], left, right))
+
+        return len(self.nodes) - 1
+
+    #Rows of the stars visible at t (minutes from local noon)
+
+    def at(self, t):
+
+        return self.between(t, t)
+
+    #Rows of the stars visible at some time between a and b (minutes from
+    #local noon), in the order of the result
+
+    def between(self, a, b):
+
+        found = []
+        stack = [self.root]
+
+        while stack:
+
+            node = stack.pop()
+
+            if node < 0:
+                continue
+
+            center, by_start, starts, by_end, ends, left, right = self.nodes[node]
+
+            if b < center:
+                # every interval of the node ends after the center
+                found.append(by_start[:np.searchsorted(starts, b, side="right")])
+                stack.append(left)
+
+            elif a > center:
+                # every interval of the node starts before the center
+                found.append(by_end[np.searchsorted(ends, a, side="left"):])
+                stack.append(right)
+
+            else:
+                found.append(by_start)
+                stack.extend((left, right))
+
+        if not found:
+            return np.zeros(0, dtype=np.int64)
+
+        return np.unique(self.rows[np.concatenate(found)])
+
+#Visibility intervals of the stars of a block from their visibility matrix
+#(time steps x stars): the runs of consecutive visible steps, in minutes from
+#local noon at the time steps. The first interval of every star starts at
+#start and the last ends at end (the refined visibility of the star).
+#Returns the star (column) of every interval, its start and end
+
+def visibility_runs(visible, elapsed, start, end):
+
+    padded = np.zeros((visible.shape[0]+2, visible.shape[1]), dtype=np.int8)
+    padded[1:-1] = visible
+
+    change = np.diff(padded, axis=0).T
+
+    stars, first = np.nonzero(change == 1)
+    last = np.nonzero(change == -1)[1] - 1
+
+    run_start = elapsed[first].astype(np.float32)
+    run_end = elapsed[last].astype(np.float32)
+
+    if len(stars):
+
+        opening = np.flatnonzero(np.r_[True, stars[1:] != stars[:-1]])
+        closing = np.r_[opening[1:] - 1, len(stars) - 1]
+
+        run_start[opening] = start[stars[opening]]
+        run_end[closing] = end[stars[closing]]
+
+    return stars, run_start, run_end
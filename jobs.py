@@ -0,0 +1,83 @@
+#Background jobs of the pages. A job runs a calculation in a thread of a pool
+#shared by all the sessions of the server, so the page script is free to
+#rerun (widget changes, polling of the progress) while it runs. The number
+#of jobs running at once is bounded by the pool, the others wait in its queue
+
+import os
+import threading
+
+from concurrent.futures import CancelledError, ThreadPoolExecutor
+
+#Jobs running at once in the server process
+JOB_WORKERS = max(int(os.environ.get("AVC_JOB_WORKERS", 2)), 1)
+
+EXECUTOR = None
+EXECUTOR_LOCK = threading.Lock()
+
+#Raised in the job (from report) once it is cancelled, and by result
+class Cancelled(Exception):
+    pass
+
+def executor():
+
+    global EXECUTOR
+
+    with EXECUTOR_LOCK:
+
+        if EXECUTOR is None:
+            EXECUTOR = ThreadPoolExecutor(max_workers=JOB_WORKERS, thread_name_prefix="avc-job")
+
+        return EXECUTOR
+
+#Calculation function(job, **kwargs) running in the shared pool. The function
+#reports its progress (fraction done) with job.report, which stops it with
+#Cancelled once the job is cancelled; it can leave partial results for the
+#page in job.preview
+
+class Job:
+
+    def __init__(self, function, **kwargs):
+
+        self.done = 0.0
+        self.preview = None
+        self.started = threading.Event()
+        self.cancelled = threading.Event()
+
+        self.future = executor().submit(self.run, function, kwargs)
+
+    def run(self, function, kwargs):
+
+        self.started.set()
+
+        if self.cancelled.is_set():
+            raise Cancelled()
+
+        return function(self, **kwargs)
+
+    def report(self, done):
+
+        if self.cancelled.is_set():
+            raise Cancelled()
+
+        self.done = done
+
+    def cancel(self):
+
+        self.cancelled.set()
+        self.future.cancel()
+
+    #queued, running or finished (the result or the error is ready)
+
+    def state(self):
+
+        if self.future.done():
+            return "finished"
+
+        return "running" if self.started.is_set() else "queued"
+
+    def result(self):
+
+        try:
+            return self.future.result()
+        except CancelledError:
+            raise Cancelled()
@@ -0,0 +1,266 @@
+import hashlib
+import json
+import os
+import threading
+import uuid
+import weakref
+
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+
+from pandas.api.types import is_numeric_dtype
+
+from instrument import span
+
+#Directory of the on-disk result cache, the cache is off when it is not set
+CACHE_DIR = os.environ.get("AVC_CACHE_DIR")
+
+#Size limit of the cache directory, the least recently used results are
+#evicted above it
+CACHE_MAX_BYTES = int(float(os.environ.get("AVC_CACHE_MAX_MB", 1024))*1024**2)
+
+#Results kept in memory by the process, in front of the directory, so an
+#unchanged calculation is served without any work even when the on-disk
+#cache is off. The least recently used results are dropped above the number
+#of results or their size
+MEMORY_ENTRIES = int(os.environ.get("AVC_RESULT_MEMORY_ENTRIES", 8))
+MEMORY_MAX_BYTES = int(float(os.environ.get("AVC_RESULT_MEMORY_MB", 512))*1024**2)
+
+MEMORY = OrderedDict()
+MEMORY_LOCK = threading.Lock()
+
+#Stable fingerprint of the content of a catalog (column names and values).
+#Numeric columns are hashed as their bytes, the other columns as the lengths
+#and the concatenation of their values as text
+
+def fingerprint(Data):
+
+    digest = hashlib.sha256()
+
+    digest.update(json.dumps([str(c) for c in Data.columns]).encode())
+
+    for column in Data.columns:
+
+        values = Data[column]
+
+        if is_numeric_dtype(values.dtype):
+            digest.update(str(values.dtype).encode())
+            digest.update(np.ascontiguousarray(values.to_numpy()).tobytes())
+
+        else:
+            text = values.astype(str).tolist()
+            digest.update(np.fromiter(map(len, text), dtype=np.int64, count=len(text)).tobytes())
+            digest.update("".join(text).encode())
+
+    return digest.hexdigest()
+
+#Fingerprints of the catalogs returned by read_data, by the buffers of
+#their columns, so the cache keys do not hash the catalog again. The buffers
+#of a catalog cannot change (read-only numpy arrays, Arrow arrays), a frame
+#is given the fingerprint only while it still has the very columns of the
+#catalog: the catalog or a shallow copy of it. An edited, sorted, sliced or
+#new column has new buffers and the frame is hashed again. The entry of a
+#catalog goes away with it, so its buffers cannot be reused meanwhile
+FINGERPRINTS = {}
+FINGERPRINTS_LOCK = threading.Lock()
+
+#Addresses and layout of the buffers of the columns, None when a column can
+#be changed in place (a writeable numpy array or another extension array)
+
+def column_buffers(Data):
+
+    buffers = []
+
+    for name, values in Data.items():
+
+        array = values.array
+
+        if hasattr(array, "__arrow_array__"):
+            chunks = array.__arrow_array__().chunks
+            layout = tuple((chunk.offset, len(chunk),
+                            tuple(0 if b is None else b.address for b in chunk.buffers()))
+                           for chunk in chunks)
+
+        elif isinstance(values.dtype, np.dtype):
+            array = np.asarray(array)
+
+            if array.flags.writeable:
+                return None
+
+            layout = (array.__array_interface__["data"][0], array.strides, array.shape)
+
+        else:
+            return None
+
+        buffers.append((str(name), str(values.dtype), layout))
+
+    return tuple(buffers)
+
+def remember_fingerprint(Data):
+
+    key = column_buffers(Data)
+
+    if key is None:
+        return
+
+    def forget(ref):
+        with FINGERPRINTS_LOCK:
+            if key in FINGERPRINTS and FINGERPRINTS[key][0] is ref:
+                del FINGERPRINTS[key]
+
+    entry = (weakref.ref(Data, forget), fingerprint(Data))
+
+    with FINGERPRINTS_LOCK:
+        FINGERPRINTS[key] = entry
+
+#Fingerprint of a frame, checked against the buffers of its columns before
+#the remembered one is used
+
+def catalog_fingerprint(Data):
+
+    key = column_buffers(Data)
+
+    with FINGERPRINTS_LOCK:
+        ref, digest = FINGERPRINTS.get(key, (None, None)) if key is not None else (None, None)
+
+    if ref is not None and ref() is not None:
+        return digest
+
+    return fingerprint(Data)
+
+#Version of the stored results, part of every key. It is bumped whenever the
+#columns of the results, their dtypes or the computed values change, so the
+#results of an older version are never served (they are evicted as the least
+#recently used). 2: start/end as int16 minute offsets instead of text,
+#3: apparent places of the fast engine at the epoch of every night
+RESULT_VERSION = 3
+
+#Key of a result from the catalog fingerprint and every setting the result
+#depends on (date, site, time grid, engine ...)
+
+def cache_key(catalog_fingerprint, **settings):
+
+    settings = json.dumps(settings, sort_keys=True, default=str)
+
+    return hashlib.sha256(f"{RESULT_VERSION}:{catalog_fingerprint}:{settings}".encode()).hexdigest()
+
+def cache_path(key, cache_dir):
+
+    return os.path.join(cache_dir, f"{key}.parquet")
+
+#Cached result for the key, from memory or from the directory, None if it is
+#not in the cache. The result is a shallow copy, the caller can add, drop or
+#edit columns without changing the cached frame (copy-on-write copies a
+#column of the copy before writing into it)
+
+def load(key, cache_dir=None):
+
+    with MEMORY_LOCK:
+
+        entry = MEMORY.get(key)
+
+        if entry is not None:
+            MEMORY.move_to_end(key)
+
+    if entry is not None:
+        return entry[0].copy(deep=False)
+
+    cache_dir = cache_dir or CACHE_DIR
+
+    if not cache_dir:
+        return None
+
+    path = cache_path(key, cache_dir)
+
+    try:
+        with span("result cache: load") as load_span:
+            Result = pd.read_parquet(path)
+            load_span["rows"] = len(Result)
+
+        # mark as recently used for the eviction
+        os.utime(path)
+
+    except Exception:
+        return None
+
+    remember(key, Result)
+
+    return Result.copy(deep=False)
+
+def remember(key, Result):
+
+    size = int(Result.memory_usage(index=True).sum())
+
+    if MEMORY_ENTRIES < 1 or size > MEMORY_MAX_BYTES:
+        return
+
+    with MEMORY_LOCK:
+
+        MEMORY.pop(key, None)
+        MEMORY[key] = (Result.copy(deep=False), size)
+
+        total = sum(size for _, size in MEMORY.values())
+
+        while len(MEMORY) > MEMORY_ENTRIES or total > MEMORY_MAX_BYTES:
+            total -= MEMORY.popitem(last=False)[1][1]
+
+#Stores the result under the key, in memory and in the directory (when it is
+#set), and evicts the least recently used results above the size limit. The
+#file is written next to its final path and moved in place, so readers never
+#see a partial file
+
+def store(key, Result, cache_dir=None, max_bytes=None):
+
+    remember(key, Result)
+
+    cache_dir = cache_dir or CACHE_DIR
+
+    if not cache_dir:
+        return
+
+    os.makedirs(cache_dir, exist_ok=True)
+
+    path = cache_path(key, cache_dir)
+    partial = f"{path}.{uuid.uuid4().hex}.tmp"
+
+    try:
+        with span("result cache: store", rows=len(Result)):
+            Result.to_parquet(partial)
+            os.replace(partial, path)
+
+    finally:
+        if os.path.exists(partial):
+            os.remove(partial)
+
+    evict(cache_dir, CACHE_MAX_BYTES if max_bytes is None else max_bytes)
+
+def evict(cache_dir, max_bytes):
+
+    entries = []
+
+    for entry in os.scandir(cache_dir):
+
+        if entry.name.endswith(".parquet"):
+
+            try:
+                stat = entry.stat()
+            except FileNotFoundError:
+                continue
+
+            entries.append((stat.st_mtime, stat.st_size, entry.path))
+
+    total = sum(size for _, size, _ in entries)
+
+    for _, size, path in sorted(entries):
+
+        if total <= max_bytes:
+            break
+
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+        total -= size
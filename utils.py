@@ -1,24 +1,18 @@
 import streamlit as st
 import base64
+import io
+import threading
+import warnings
 
-from astropy.coordinates import SkyCoord, EarthLocation, AltAz, get_sun
-import astropy.units as u
-import numpy as np
-import matplotlib.pyplot as plt
-from astropy.time import Time
+from functools import lru_cache
 
-import pandas as pd
+import visibility
 
-from timezonefinder import TimezoneFinder
-
-from zoneinfo import ZoneInfo
-
-def is_numeric(s):
-    try:
-        float(s)
-        return True
-    except ValueError:
-        return False
+from visibility import is_numeric
+from visibility import ENGINES, MAX_RANGE_NIGHTS, MAX_WORKERS
+from visibility import Observability_Single
+from visibility import format_times
+from visibility import np, pd, u
 
 def vspace(units=1):
     units = max(0, units)
@@ -26,257 +20,101 @@ def vspace(units=1):
         f"<div style='height: {0.6 * units}em;'></div>",
         unsafe_allow_html=True
     )
-#Function to read data from a file
-
-@st.cache_data
-def read_data(file_path):
-
-    try:
-        file=pd.read_csv(file_path, sep=None, engine='python')
-
-    except Exception as e:
-        raise ValueError('Error Loading File')
-    
-    file.columns = [c.strip().lower() for c in file.columns]
-
-#    name_col = next((c for c in file.columns if 'name' in c), None)
-#    mag_col = next((c for c in file.columns if 'mag' in c), None)
-#    ra_col = next((c for c in file.columns if 'ra' in c), None)
-#    dec_col = next((c for c in file.columns if 'dec' in c), None)
-#    coord_col = next((c for c in file.columns if 'coord' in c), None)
-
-    name_col = next((c for c in file.columns if c == 'star_name'), None)
-    mag_col = next((c for c in file.columns if 'mag_v' in c), None)
-    ra_col = next((c for c in file.columns if c == 'ra'), None)
-    dec_col = next((c for c in file.columns if c == 'dec'), None)
-    coord_col = next((c for c in file.columns if c == 'coord'), None)
-
-    if ra_col and dec_col:
-        ra = file[ra_col]
-        dec = file[dec_col]
-    elif coord_col:
-        ra = file[coord_col].str.split(',').str[0]
-        dec = file[coord_col].str.split(',').str[1]
-
-    else:
-        raise ValueError('No RA/DEC data found in the file. Use valid data/coloumn name')
-    
-    if not name_col is None:
-        star_name=file[name_col]
-
-    else:
-        raise ValueError('Name of the stars not found')
-    
-    
-    if not (pd.to_numeric(ra, errors="coerce").notna().all() and 
-            pd.to_numeric(dec, errors="coerce").notna().all()
-            ):
-        raise ValueError("RA or DEC contains invalid values.")
-
-    if file[[ra_col, dec_col, name_col]].isnull().any().any():
-        raise ValueError("One or more required columns contain none values.")
-    
-    if mag_col:
-        mag = file[mag_col]
-        
-        # Check if magnitude values are valid
-        valid_mag = pd.to_numeric(mag, errors="coerce").notna().all()
-
-        if not valid_mag:
-            st.warning(
-                "Warning: MAG column contains invalid or missing values.", width=290
-             )
-        
-        # Always create DataFrame with mag column if it exists
-        Data = pd.DataFrame({
-            'star name': star_name,
-            'ra': ra,
-            'dec': dec,
-            'mag': mag
-        })
-    else:
-        Data = pd.DataFrame({
-            'star name': star_name,
-            'ra': ra,
-            'dec': dec
-        })
-        
-    del file
-    return Data
-
-@st.cache_data
-def Observability(Data, _utc_shift,date, _Loc, timezone_local):
-
-    date_str = date.strftime("%Y-%m-%d")
-
-    #12 noon in local time zone
-    time_in_local = Time( f"{date} 12:00:00")-_utc_shift 
-
-    # time array covering next 24 hours in steps of 5 min
-    elapsed = np.arange(0, (24*60)+5, 5)*u.min
-
-    #time array of next 24 hours starting from noon cest
-    time = time_in_local + elapsed 
-    time_array=time[:,None]
-
-    # Creating a series of coordinate frames in the AltAz system,
-    # each one corresponding to a specific time from the time array
-    # corresponding to a specific location given by obs
-
-    frame_local_24h = AltAz(obstime=time[:,None], location=_Loc)
-    Frame_Local_24h = AltAz(obstime=time, location=_Loc)
-
-    #Betelgeuse RA and DEC   
-
-    Coordinates_of_the_stars=SkyCoord(ra=Data['ra'].values*u.deg, dec=Data['dec'].values*u.deg) 
-
-    # transforms the declination and right ascension of the
-    # star into altitudes and azimuths for the time sequence of frames defined
-
-    Coordinates_local = Coordinates_of_the_stars[None, :].transform_to(frame_local_24h)
-
-    # time-dependent coordinates of the Sun in equatorial system
-    sun = get_sun(time)
-    sun_local = sun.transform_to(Frame_Local_24h)
-
-    # night time w.r.t to the location
-    elapsed_night = elapsed[np.where(sun_local.alt < 0)]
-
-    if len(elapsed_night)==0:
 
-        raise ValueError('No night time detected for the given location at the given date')
+#Function to read data from a file, the warnings about the content of
+#the catalog are shown on the page. An uploaded file is cached by its upload
+#id, so a rerun neither hashes nor copies the catalog: the catalog is shared
+#by the reruns and the sessions, every caller gets a shallow copy of it (a
+#write into the copy copies the column first, the shared catalog is
+#read-only). The catalogs of the last uploads are kept, for an hour at most
 
-    #Coordinates of the stars when sun is down
-    Coord_local_sunset = Coordinates_local.alt[np.where(sun_local.alt < 0)]
-
-    #Observabilty Duration
-    Duration_of_Observabilty=[]
+def read_data(file_path):
 
-    for i in range(len(Coord_local_sunset[0])):
+    return read_catalog(getattr(file_path, 'file_id', file_path), file_path).copy(deep=False)
 
-        if len(elapsed_night[Coord_local_sunset.transpose()[i]>0])>0:
+@st.cache_resource(max_entries=8, ttl=3600)
+def read_catalog(file_key, _file_path):
 
-            Duration_of_Observabilty.append((elapsed_night[Coord_local_sunset.transpose()[i]>0][-1]-
-                                            elapsed_night[Coord_local_sunset.transpose()[i]>0][0]).to_value(u.min))
-        else:
-            Duration_of_Observabilty.append(0)
+    file_path = _file_path
 
-    Data['Visibility (min)']=Duration_of_Observabilty
+    with warnings.catch_warnings(record=True) as caught:
 
-    #Time of observability in Local timezone
+        warnings.simplefilter("always", visibility.CatalogWarning)
 
-    Observability_Time_Local=[]
-    for i in range(len(Coord_local_sunset[0])):
-        
-        Observability_Time_Local.append(time_array[(Coordinates_local.alt.transpose()[i][:,None] > 0*u.deg)
-                                            & (sun_local.alt[:, None] < 0*u.deg)].to_datetime(timezone=timezone_local))
+        Data = visibility.read_data(file_path)
 
-    formatted_start=[]
-    formatted_end=[]
+    for warning in caught:
 
-    for dt in Observability_Time_Local:
-        if len(dt) > 0:
-            formatted_start.append(dt[0].strftime("%Y-%m-%d %H:%M"))
-            formatted_end.append(dt[-1].strftime("%Y-%m-%d %H:%M"))
+        if issubclass(warning.category, visibility.CatalogWarning):
+            st.warning(str(warning.message), width=290)
         else:
-            formatted_start.append("Not visible")
-            formatted_end.append("Not visible")
-
-    Data['Visibility (start)'] = formatted_start
-    Data['Visibility (end)'] = formatted_end
+            warnings.showwarning(warning.message, warning.category, warning.filename, warning.lineno)
 
     return Data
 
-def Observability_Single(ra, dec, _utc_shift,date, _Loc, timezone_local):
-
-    date_str = date.strftime("%Y-%m-%d")
-
-    #12 noon in local time zone
-    time_in_local = Time( f"{date} 12:00:00")-_utc_shift 
-
-    # time array covering next 24 hours in steps of 5 min
-    elapsed = np.arange(0, (24*60)+5, 5)*u.min
-
-    #time array of next 24 hours starting from noon cest
-    time = time_in_local + elapsed 
-
-    # Creating a series of coordinate frames in the AltAz system,
-    # each one corresponding to a specific time from the time array
-    # corresponding to a specific location given by obs
-
-    frame_local_24h = AltAz(obstime=time, location=_Loc)
-
-    #Betelgeuse RA and DEC   
+#The catalog calculations are not wrapped in st.cache_data, they report their
+#progress to elements of the page which the cache cannot replay. Repeated
+#runs are served by the result cache (in memory, and on disk when it is set)
+#and by the row memo
 
-    Coordinates_of_the_star=SkyCoord(ra=ra*u.deg, dec=dec*u.deg) 
+Observability = visibility.Observability
 
-    # transforms the declination and right ascension of the
-    # star into altitudes and azimuths for the time sequence of frames defined
+Observability_Range = visibility.Observability_Range
 
-    Coordinates_local = Coordinates_of_the_star.transform_to(frame_local_24h)
+Coordinates = st.cache_data(visibility.Coordinates)
 
-    # time-dependent coordinates of the Sun in equatorial system
-    sun = get_sun(time)
-    sun_local = sun.transform_to(frame_local_24h)
+#Visibility of one star with its rendered altitude chart (PNG) and the
+#downsampled curves for a chart drawn in the browser, cached by star, date,
+#site and time grid so a rerun with the same inputs computes and draws nothing
 
-    # night time w.r.t to the location
-    elapsed_night = elapsed[np.where(sun_local.alt < 0)]
+@st.cache_data(max_entries=256)
+def Single_Star_Chart(ra, dec, utc_shift_h, date, lat, long, step=5, tolerance=None):
 
-    if len(elapsed_night)==0:
+    Loc, timezone_local, tz_string = visibility.Coordinates(lat, long)
 
-        raise ValueError('No night time detected for the given location at the given date')
+    Duration, formatted, Curves = visibility.Single_Star_Night(ra, dec, utc_shift_h*u.hour, date, Loc,
+                                                               timezone_local, step, tolerance)
 
-    #Coordinates of the stars when sun is down
-    Coord_local_sunset = Coordinates_local.alt[np.where(sun_local.alt < 0)]
+    png = visibility.figure_png(visibility.altitude_figure(Curves))
 
-    #Observabilty Duration
+    return Duration, formatted, png, visibility.downsample(Curves)
 
+#File of a result (or of its rows) for a download button, built when the
+#button is clicked. Streamlit takes the whole file as bytes, so it is written
+#in memory; the rows are still formatted chunk by chunk, only the file (not
+#a formatted copy of the result) is held at once
 
-    if len(elapsed_night[Coord_local_sunset>0])>0:
+def export_file(Result, format, rows=None):
 
-        Duration_of_Observabilty=((elapsed_night[Coord_local_sunset>0][-1]-
-                                        elapsed_night[Coord_local_sunset>0][0]).to_value(u.min))
-    else:
-        Duration_of_Observabilty=0
+    file = io.BytesIO()
 
-    #Time of observability in Local timezone
-    
-    Observability_Time_Local=(time[(Coordinates_local.alt > 0*u.deg)
-                                            & (sun_local.alt < 0*u.deg)].to_datetime(timezone=timezone_local))
+    visibility.write_frames(visibility.export_frames(Result, rows), file, format)
 
-    formatted=[]
+    return file.getvalue()
 
-    if len(Observability_Time_Local) > 0:
-        formatted.append(Observability_Time_Local[0].strftime("%Y-%m-%d %H:%M"))
-        formatted.append(Observability_Time_Local[-1].strftime("%Y-%m-%d %H:%M"))
-    else:
-        formatted.append("Not Visibile")
+#The timezone and Earth orientation data are loaded in the background while
+#the first page is drawn, the first site lookup or calculation waits for them
+#only if it is started right away
 
-    plt.plot(elapsed.to(u.h), sun_local.alt, color='orange', label='Sun')
-    plt.plot(elapsed.to(u.h), Coordinates_local.alt, color='red',
-    linestyle=':', label='Star (daylight)')
-    plt.plot(elapsed_night.to(u.h), Coord_local_sunset, color='red',
-    label='Star (night)')
+def preload():
 
-    plt.xlabel('Time from noon [h]')
-    plt.xlim(0, 24)
-    plt.xticks(np.arange(13)*2)
-    plt.ylim(0,90)
-    plt.ylabel('Altitude [deg]')
-    plt.legend(loc='best')
-    plt.title("Altitude vs Time")
+    visibility.timezone_finder()
 
+    try:
+        visibility.earth_orientation.load()
+    except ValueError:
+        # reported by the first calculation
+        pass
 
-    fig = plt.gcf()  
-    plt.close()  
+threading.Thread(target=preload, daemon=True).start()
 
-    return Duration_of_Observabilty, formatted, fig
+#Style of the page background, the image is read and encoded once per process
 
-def add_bg_from_local(image_file):
+@lru_cache(maxsize=None)
+def background_css(image_file):
     with open(image_file, "rb") as f:
         encoded_string = base64.b64encode(f.read()).decode()
-    st.markdown(
-        f"""
+    return f"""
         <style>
         .stApp {{
             background-image: url("data:image/png;base64,{encoded_string}");
@@ -285,24 +123,7 @@ def add_bg_from_local(image_file):
             background-attachment: fixed;
         }}
         </style>
-        """,
-        unsafe_allow_html=True
-    )
+        """
 
-@st.cache_data
-def Coordinates(lat, long):
-    if is_numeric(lat) and is_numeric(long):
-
-        try:
-
-            tf = TimezoneFinder()
-            Loc = EarthLocation(lat=float(lat), lon=float(long))
-            tz_string = tf.timezone_at(lat=Loc.lat.deg, lng=Loc.lon.deg)
-            timezone_local = ZoneInfo(tz_string)
-
-            return Loc, timezone_local, tz_string
-
-        except Exception as e:
-            raise ValueError('Please enter valid latitude and longitude')
-    else:
-        raise ValueError('Please enter valid latitude and longitude')
\ No newline at end of file
+def add_bg_from_local(image_file):
+    st.markdown(background_css(image_file), unsafe_allow_html=True)
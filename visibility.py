@@ -0,0 +1,1660 @@
+import csv
+import datetime
+import io
+import json
+import multiprocessing
+import os
+import threading
+import warnings
+
+from collections import deque, namedtuple, OrderedDict
+from contextlib import nullcontext
+from importlib.util import find_spec
+from functools import lru_cache
+from itertools import chain, repeat
+from concurrent.futures import ProcessPoolExecutor
+
+from astropy.coordinates import SkyCoord, EarthLocation, AltAz, TETE, get_sun
+import astropy.units as u
+import numpy as np
+from astropy.time import Time
+
+import pandas as pd
+from pandas.api.types import is_float_dtype, is_numeric_dtype
+
+import earth_orientation
+import result_cache
+from instrument import span
+from interval_index import VisibilityIndex, visibility_runs
+
+from zoneinfo import ZoneInfo
+
+#Warning about the content of a catalog that does not stop reading it
+class CatalogWarning(UserWarning):
+    pass
+
+def is_numeric(s):
+    try:
+        float(s)
+        return True
+    except ValueError:
+        return False
+
+#Bytes read from the start of a catalog to detect its format and delimiter
+SNIFF_BYTES = 64*1024
+
+#Leading bytes of the binary table formats
+MAGIC_BYTES = {b'PAR1': 'parquet', b'ARROW1': 'feather', b'FEA1': 'feather', b'SIMPLE': 'fits'}
+
+#Format of a catalog from its leading bytes, or else from its extension
+
+def file_format(sample, name):
+
+    for magic, format in MAGIC_BYTES.items():
+        if sample.startswith(magic):
+            return format
+
+    extension = str(name).rsplit('.', 1)[-1].lower()
+
+    if extension in ('parquet', 'pq'):
+        return 'parquet'
+    elif extension in ('feather', 'arrow', 'ipc'):
+        return 'feather'
+    elif extension in ('fits', 'fit', 'fts'):
+        return 'fits'
+
+    return 'text'
+
+#Delimiter and header of a text catalog, sniffed once from the sample
+
+def sniff_delimiter(sample):
+
+    lines = sample.decode('utf-8', errors='replace').splitlines()
+
+    # the last line of a truncated sample may be partial
+    if len(sample) == SNIFF_BYTES and len(lines) > 1:
+        lines = lines[:-1]
+
+    try:
+        delimiter = csv.Sniffer().sniff('\n'.join(lines), delimiters=',;\t| ').delimiter
+    except csv.Error:
+        delimiter = ','
+
+    header = lines[0] if lines else ''
+
+    # columns aligned with runs of whitespace
+    if delimiter not in header and len(header.split()) > 1:
+        delimiter = ' '
+
+    return delimiter, header
+
+#Reads a text catalog with the C or pyarrow parser, RA/DEC parsed as floats.
+#If RA/DEC can not be parsed as floats they are read as they are and
+#rejected by the validation
+
+def read_text(stream, sample):
+
+    delimiter, header = sniff_delimiter(sample)
+
+    if delimiter == ' ':
+        sep, engine = r'\s+', 'c'
+        names = header.split()
+    else:
+        sep, engine = delimiter, ('pyarrow' if find_spec('pyarrow') else 'c')
+        names = next(csv.reader([header], delimiter=delimiter), [])
+
+    dtype = {name: 'float64' for name in names if name.strip().lower() in ('ra', 'dec')}
+
+    try:
+        return pd.read_csv(stream, sep=sep, engine=engine, dtype=dtype)
+
+    except Exception:
+        stream.seek(0)
+        return pd.read_csv(stream, sep=sep, engine='c')
+
+def read_table(stream, sample, name):
+
+    format = file_format(sample, name)
+
+    if format == 'parquet':
+        return pd.read_parquet(stream)
+
+    elif format == 'feather':
+
+        if sample.startswith((b'ARROW1', b'FEA1')):
+            return pd.read_feather(stream)
+
+        import pyarrow.ipc
+        return pyarrow.ipc.open_stream(stream).read_pandas()
+
+    elif format == 'fits':
+
+        from astropy.table import Table
+        return Table.read(stream, format='fits', character_as_bytes=False).to_pandas()
+
+    return read_text(stream, sample)
+
+#Function to read data from a file
+#(csv/txt/dat text tables, Parquet, Arrow/Feather or FITS tables)
+
+def read_data(file_path):
+
+    try:
+        with (nullcontext(file_path) if hasattr(file_path, 'read') else open(file_path, 'rb')) as stream:
+
+            stream.seek(0)
+            sample = stream.read(SNIFF_BYTES)
+            stream.seek(0)
+
+            with span("read: parse") as parse:
+                file = read_table(stream, sample, getattr(stream, 'name', file_path))
+                parse["rows"] = len(file)
+
+    except Exception as e:
+        raise ValueError('Error Loading File')
+
+    with span("read: validate", rows=len(file)):
+        Data = read_only(catalog_columns(file))
+
+    del file
+
+    # the content is hashed once here, the result cache keys of this frame
+    # (and of its shallow copies, while they share its columns) reuse it
+    with span("read: fingerprint", rows=len(Data)):
+        result_cache.remember_fingerprint(Data)
+
+    return Data
+
+#Catalog with its numpy columns in read-only arrays of their own, so it can
+#be shared: writing into it raises, writing into a shallow copy of it copies
+#the column first (copy-on-write). The Arrow (string) columns are immutable
+#already, a write replaces their buffers
+
+def read_only(Data):
+
+    columns = {}
+
+    for name, values in Data.items():
+
+        if isinstance(values.dtype, np.dtype):
+            values = values.to_numpy(copy=True)
+            values.flags.writeable = False
+
+        columns[name] = values
+
+    return pd.DataFrame(columns, index=Data.index, copy=False)
+
+#Star name, RA, DEC (and magnitude) columns of a table read from a file,
+#validated in a single vectorized pass
+
+def catalog_columns(file):
+
+    file.columns = [str(c).strip().lower() for c in file.columns]
+
+#    name_col = next((c for c in file.columns if 'name' in c), None)
+#    mag_col = next((c for c in file.columns if 'mag' in c), None)
+#    ra_col = next((c for c in file.columns if 'ra' in c), None)
+#    dec_col = next((c for c in file.columns if 'dec' in c), None)
+#    coord_col = next((c for c in file.columns if 'coord' in c), None)
+
+    name_col = next((c for c in file.columns if c == 'star_name'), None)
+    mag_col = next((c for c in file.columns if 'mag_v' in c), None)
+    ra_col = next((c for c in file.columns if c == 'ra'), None)
+    dec_col = next((c for c in file.columns if c == 'dec'), None)
+    coord_col = next((c for c in file.columns if c == 'coord'), None)
+
+    if ra_col and dec_col:
+        ra = file[ra_col]
+        dec = file[dec_col]
+    elif coord_col:
+        coord = file[coord_col].astype(str).str.split(',', n=1, expand=True)
+
+        if coord.shape[1] < 2:
+            raise ValueError("RA or DEC contains invalid values.")
+
+        ra = coord[0]
+        dec = coord[1]
+
+    else:
+        raise ValueError('No RA/DEC data found in the file. Use valid data/coloumn name')
+    
+    if not name_col is None:
+        star_name=file[name_col]
+
+    else:
+        raise ValueError('Name of the stars not found')
+    
+    # single vectorized validation, the conversion is skipped for columns
+    # already parsed as floats
+    if not is_float_dtype(ra):
+        ra = pd.to_numeric(ra, errors="coerce")
+    if not is_float_dtype(dec):
+        dec = pd.to_numeric(dec, errors="coerce")
+
+    if (ra.isna().to_numpy() | dec.isna().to_numpy()).any():
+        raise ValueError("RA or DEC contains invalid values.")
+
+    if star_name.isna().any():
+        raise ValueError("One or more required columns contain none values.")
+    
+    if mag_col:
+        mag = file[mag_col]
+        
+        # Check if magnitude values are valid
+        valid_mag = (mag if is_numeric_dtype(mag) else pd.to_numeric(mag, errors="coerce")).notna().all()
+
+        if not valid_mag:
+            warnings.warn("Warning: MAG column contains invalid or missing values.",
+                          CatalogWarning, stacklevel=2)
+        
+        # Always create DataFrame with mag column if it exists
+        Data = pd.DataFrame({
+            'star name': star_name,
+            'ra': ra,
+            'dec': dec,
+            'mag': mag
+        }, copy=False)
+    else:
+        Data = pd.DataFrame({
+            'star name': star_name,
+            'ra': ra,
+            'dec': dec
+        }, copy=False)
+
+    return Data
+
+#Names of the engines that can compute the altitudes of the stars
+ENGINES = ("astropy", "fast")
+
+#Altitudes of the stars in degrees, shape (len(time), number of stars),
+#using the full ICRS -> AltAz transformation of astropy.
+#With pairwise=True every star has its own time and the result has the shape of ra
+
+def astropy_altitudes(ra, dec, time, Loc, pairwise=False):
+
+    Coordinates_of_the_stars=SkyCoord(ra=ra*u.deg, dec=dec*u.deg)
+
+    if pairwise:
+        return Coordinates_of_the_stars.transform_to(AltAz(obstime=time, location=Loc)).alt.deg
+
+    frame_local_24h = AltAz(obstime=time[:,None], location=Loc)
+
+    return Coordinates_of_the_stars[None, :].transform_to(frame_local_24h).alt.deg
+
+#Altitudes of the stars in degrees, shape (len(time), number of stars),
+#from the hour angle and declination of the stars.
+#The apparent place of every star is computed once, for the epoch (by
+#default the middle of the time span), and the local apparent sidereal time
+#once per time step, the whole grid is then a single NumPy broadcast
+
+def fast_altitudes(ra, dec, time, Loc, pairwise=False, epoch=None):
+
+    epoch = time[len(time)//2] if epoch is None else epoch
+
+    apparent = SkyCoord(ra=ra*u.deg, dec=dec*u.deg).transform_to(TETE(obstime=epoch))
+
+    local_sidereal_time = time.sidereal_time('apparent', longitude=Loc.lon).rad
+
+    if pairwise:
+        return hour_angle_altitudes(apparent.ra.rad, apparent.dec.rad, local_sidereal_time, Loc.lat.rad)
+
+    return hour_angle_altitudes(apparent.ra.rad[None, :], apparent.dec.rad[None, :],
+                                local_sidereal_time[:, None], Loc.lat.rad)
+
+#Altitudes in degrees from the apparent places (rad) of the stars, the local
+#apparent sidereal times (rad) and the latitude (rad) of the site, broadcast
+#against each other (e.g. over a time, site or star dimension)
+
+def hour_angle_altitudes(ra_app, dec_app, local_sidereal_time, lat):
+
+    sin_alt = (np.sin(lat)*np.sin(dec_app)
+               + np.cos(lat)*np.cos(dec_app)*np.cos(local_sidereal_time - ra_app))
+
+    return np.degrees(np.arcsin(np.clip(sin_alt, -1, 1)))
+
+def star_altitudes(ra, dec, time, Loc, engine="astropy", pairwise=False, epoch=None):
+
+    if engine == "astropy":
+        return astropy_altitudes(ra, dec, time, Loc, pairwise)
+
+    elif engine == "fast":
+        return fast_altitudes(ra, dec, time, Loc, pairwise, epoch)
+
+    else:
+        raise ValueError(f"Unknown engine '{engine}', use one of {', '.join(ENGINES)}")
+
+#Epoch of the apparent places of the fast engine for a night: the middle of
+#its time grid, whatever the stars or the other nights computed with it
+
+def night_epoch(night):
+
+    return night.time[len(night.time)//2]
+
+#Altitudes of the stars in degrees for several nights on the same grid of
+#time steps, shape (nights, steps, stars), at the given indices of the steps
+#only (all of them by default). With the fast engine the apparent places are
+#computed for the epoch of every night, in one broadcast over the nights and
+#the stars
+
+def nights_altitudes(ra, dec, nights, Loc, engine="astropy", steps=None):
+
+    middle = len(nights[0].time)//2
+    steps = np.arange(len(nights[0].time)) if steps is None else np.asarray(steps)
+
+    time = np.concatenate([night.time[steps] for night in nights])
+
+    if engine != "fast":
+        return star_altitudes(ra, dec, time, Loc, engine).reshape(len(nights), len(steps), len(ra))
+
+    epochs = np.concatenate([night.time[middle:middle+1] for night in nights])
+
+    apparent = SkyCoord(ra=ra*u.deg, dec=dec*u.deg)[None, :].transform_to(TETE(obstime=epochs[:, None]))
+
+    local_sidereal_time = time.sidereal_time('apparent', longitude=Loc.lon).rad.reshape(len(nights),
+                                                                                      len(steps))
+
+    return hour_angle_altitudes(apparent.ra.rad[:, None, :], apparent.dec.rad[:, None, :],
+                                local_sidereal_time[:, :, None], Loc.lat.rad)
+
+#Maximum altitude difference in degrees between the fast engine and astropy,
+#evaluated on an evenly spaced sample of the stars
+
+def fast_altitude_error(ra, dec, time, Loc, sample=200):
+
+    ra = np.asarray(ra, dtype=float)
+    dec = np.asarray(dec, dtype=float)
+
+    if len(ra) == 0:
+        return 0.0
+
+    idx = np.unique(np.linspace(0, len(ra)-1, min(sample, len(ra))).astype(int))
+
+    error = np.abs(fast_altitudes(ra[idx], dec[idx], time, Loc)
+                   - astropy_altitudes(ra[idx], dec[idx], time, Loc))
+
+    return float(error.max())
+
+#Maximum altitude difference in degrees between the fast engine and astropy
+#over all the nights, on evenly spaced samples of the stars and of the time
+#steps of every night (its first and last steps included). The samples are
+#made smaller for long ranges, about as many altitudes are compared as for
+#a single night
+
+def fast_nights_error(ra, dec, nights, Loc, sample=200):
+
+    ra = np.asarray(ra, dtype=float)
+    dec = np.asarray(dec, dtype=float)
+
+    if len(ra) == 0:
+        return 0.0
+
+    steps = len(nights[0].time)
+    cells = sample*steps
+
+    stars = min(sample, len(ra))
+    times = min(max(cells // (stars*len(nights)), 3), steps)
+    stars = min(stars, max(cells // (times*len(nights)), 1))
+
+    idx = np.unique(np.linspace(0, len(ra)-1, stars).astype(int))
+    steps = np.unique(np.linspace(0, steps-1, times).astype(int))
+
+    error = np.abs(nights_altitudes(ra[idx], dec[idx], nights, Loc, "fast", steps)
+                   - nights_altitudes(ra[idx], dec[idx], nights, Loc, "astropy", steps))
+
+    return float(error.max())
+
+#Altitude of the sun in degrees at the given times
+
+def sun_altitudes(time, Loc):
+
+    # time-dependent coordinates of the Sun in equatorial system
+    sun = get_sun(time)
+
+    return sun.transform_to(AltAz(obstime=time, location=Loc)).alt.deg
+
+#Times (in minutes) where the altitude crosses the horizon inside the brackets
+#[lo, hi]: bisection until the brackets are narrower than the tolerance
+#(in minutes), then linear interpolation inside the final bracket.
+#altitude_at(t) returns the altitudes of the brackets at the times t
+
+def refine_crossings(altitude_at, lo, hi, alt_lo, alt_hi, tolerance):
+
+    lo = np.array(lo, dtype=float)
+    hi = np.array(hi, dtype=float)
+    alt_lo = np.array(alt_lo, dtype=float)
+    alt_hi = np.array(alt_hi, dtype=float)
+
+    tolerance = max(float(tolerance), 1e-3)
+
+    while len(lo) and (hi-lo).max() > tolerance:
+
+        mid = (lo+hi)/2
+        alt_mid = altitude_at(mid)
+
+        # the crossing is in the upper half where mid is on the same side as lo
+        upper = (alt_mid > 0) == (alt_lo > 0)
+
+        lo = np.where(upper, mid, lo)
+        alt_lo = np.where(upper, alt_mid, alt_lo)
+        hi = np.where(upper, hi, mid)
+        alt_hi = np.where(upper, alt_hi, alt_mid)
+
+    step = alt_lo-alt_hi
+    fraction = np.divide(alt_lo, step, out=np.full_like(step, 0.5), where=step != 0)
+
+    return lo + (hi-lo)*np.clip(fraction, 0, 1)
+
+#Local time labels of whole minutes from the time base (UTC timestamp of
+#local noon), "Not visible" for negative minutes. The labels are only made
+#for the rows that are shown or exported
+
+def local_times(minutes, time_base, timezone_local):
+
+    minutes = np.asarray(minutes, dtype=np.int64)
+
+    times = pd.DatetimeIndex(pd.Timestamp(time_base) + pd.to_timedelta(np.maximum(minutes, 0), unit='min'))
+
+    labels = times.tz_convert(timezone_local).strftime("%Y-%m-%d %H:%M").to_numpy(dtype=str)
+
+    return np.where(minutes >= 0, labels, "Not visible")
+
+#Time axis of one night (24 hours from local noon) and everything derived
+#from the sun that is shared by all stars:
+#elapsed - minutes from local noon of every time step
+#sun_alt - altitude of the sun (deg) at every time step
+#sun_crossings - refined time (min) of sunset/sunrise inside every time step
+#                (nan where the sun does not cross the horizon or without tolerance)
+#time_base - UTC timestamp of local noon, the minute offsets of the results count from it
+#timezone - time zone of the local time labels
+#tolerance - precision (min) of the rise/set refinement, None for the grid precision
+#sidereal - local apparent sidereal time (rad) at every time step
+
+Night = namedtuple("Night", ["time", "elapsed", "sun_alt", "sun_crossings", "time_base", "timezone",
+                             "tolerance", "sidereal"])
+
+#Nights of `nights` consecutive dates starting at date, the sun of all the
+#nights is computed in a single batch on one time axis. The arrays are read-only
+
+def build_nights(date, nights, utc_shift_min, Loc, timezone_local, step=5, tolerance=None):
+
+    earth_orientation.load()
+
+    #12 noon in local time zone
+    time_in_local = Time( f"{date} 12:00:00")-utc_shift_min*u.min
+
+    # time array covering next 24 hours in steps of `step` min
+    # (adjusted so the steps divide the 24 hours evenly)
+    intervals = max(int(np.ceil((24*60)/step)), 1)
+    elapsed = np.arange(intervals+1)*((24*60)/intervals)
+
+    # minutes from the first noon, the n-th night starts n days later
+    offsets = (np.arange(nights)*(24*60))[:, None] + elapsed[None, :]
+
+    #time array of next 24 hours starting from noon, for every night
+    time = time_in_local + offsets.ravel()*u.min
+
+    with span("sun transform", rows=len(time)):
+        sun_alt = sun_altitudes(time, Loc).reshape(nights, -1)
+
+    sun_crossings = np.full((nights, len(elapsed)-1), np.nan)
+
+    if tolerance is not None:
+
+        n, k = np.nonzero((sun_alt[:, :-1] < 0) != (sun_alt[:, 1:] < 0))
+
+        with span("sun refinement", rows=len(n)):
+            sun_crossings[n, k] = refine_crossings(lambda t: sun_altitudes(time_in_local + t*u.min, Loc),
+                                                   offsets[n, k], offsets[n, k+1],
+                                                   sun_alt[n, k], sun_alt[n, k+1],
+                                                   tolerance) - offsets[n, 0]
+
+    time_base = pd.Timestamp(time_in_local.to_datetime(), tz='UTC').round('s')
+
+    # local apparent sidereal time (in rad) of the time steps, for the
+    # geometric classification of the stars
+    with span("sidereal time", rows=len(time)):
+        sidereal = time.sidereal_time('apparent', longitude=Loc.lon).rad.reshape(nights, -1)
+
+    for array in (elapsed, sun_alt, sun_crossings, sidereal):
+        array.flags.writeable = False
+
+    time = time.reshape(nights, -1)
+
+    return tuple(Night(time[n], elapsed, sun_alt[n], sun_crossings[n],
+                       time_base + pd.Timedelta(days=n), timezone_local, tolerance, sidereal[n])
+                 for n in range(nights))
+
+#Number of nights (date, site, time grid) kept in the sun cache
+NIGHT_CACHE_SIZE = 128
+
+#Sun track and night of one date, site and time grid, shared between the pages
+#and between calls that only change the stars. The site is given by its
+#rounded coordinates so nearby inputs share the entry
+
+@lru_cache(maxsize=NIGHT_CACHE_SIZE)
+def cached_night_grid(date, utc_shift_min, lat, lon, height, tz_key, step, tolerance):
+
+    Loc = EarthLocation(lat=lat*u.deg, lon=lon*u.deg, height=height*u.m)
+
+    return build_nights(date, 1, utc_shift_min, Loc, ZoneInfo(tz_key), step, tolerance)[0]
+
+def Night_Grid(date, utc_shift, Loc, timezone_local, step=5, tolerance=None, require_night=True):
+
+    with span("night grid"):
+        night = cached_night_grid(date,
+                                  round(float(utc_shift.to_value(u.min)), 3),
+                                  round(float(Loc.lat.deg), 4),
+                                  round(float(Loc.lon.deg), 4),
+                                  round(float(Loc.height.to_value(u.m))),
+                                  str(timezone_local),
+                                  float(step),
+                                  None if tolerance is None else float(tolerance))
+
+    # night time w.r.t to the location
+    if require_night and not (night.sun_alt < 0).any():
+
+        raise ValueError('No night time detected for the given location at the given date')
+
+    return night
+
+#Time base of the start/end minutes of a result: UTC time of local noon of
+#its first date (base_date) and time zone of the labels. The minutes of the
+#rows of later dates count from local noon of their own date
+
+def time_base_attrs(night, date):
+
+    return dict(time_base=night.time_base.isoformat(), timezone=str(night.timezone), base_date=str(date))
+
+#Copy of a result with the start/end minutes as local time labels, made
+#only for the rows that are shown or exported. The rows of a multi-site
+#result are formatted with the time base of their site (attrs['sites'])
+
+def format_times(Result):
+
+    Result = Result.copy()
+
+    if 'site' in Result.columns and 'sites' in Result.attrs:
+        groups = [(Result.attrs['sites'][site], rows)
+                  for site, rows in Result.groupby('site', sort=False).indices.items()]
+    else:
+        groups = [(Result.attrs, np.arange(len(Result)))]
+
+    days = np.zeros(len(Result), dtype=np.int64)
+
+    for column in ('Visibility (start)', 'Visibility (end)'):
+
+        minutes = Result[column].to_numpy(dtype=np.int64)
+        labels = np.empty(len(Result), dtype=object)
+
+        for attrs, rows in groups:
+
+            if 'date' in Result.columns:
+                days[rows] = (pd.to_datetime(Result['date'].iloc[rows])
+                              - pd.Timestamp(attrs['base_date'])).dt.days.to_numpy()
+
+            labels[rows] = local_times(np.where(minutes[rows] >= 0, minutes[rows] + days[rows]*24*60, -1),
+                                       attrs['time_base'], attrs['timezone'])
+
+        Result[column] = labels.astype(str)
+
+    return Result
+
+#Rows of a result formatted for export, chunk_size rows at a time, so the
+#labels of the whole result are never built at once. rows selects (and
+#orders) the rows of the result to export, all of them by default
+
+EXPORT_ROWS = 50_000
+
+def export_frames(Result, rows=None, chunk_size=EXPORT_ROWS):
+
+    if rows is None:
+        rows = np.arange(len(Result))
+
+    # an empty result still gives the header of the file
+    for first in range(0, max(len(rows), 1), chunk_size):
+        yield format_times(Result.iloc[rows[first:first+chunk_size]])
+
+#Writes the blocks of rows to a CSV or Parquet file as they arrive, returns
+#the number of rows written. target is a path or a binary file object
+
+def write_frames(frames, target, format="csv"):
+
+    rows = 0
+
+    with (nullcontext(target) if hasattr(target, 'write') else open(target, 'wb')) as stream:
+
+        if format == "parquet":
+
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+
+            writer = None
+
+            try:
+                for Rows in frames:
+
+                    table = pa.Table.from_pandas(Rows, preserve_index=False,
+                                                 schema=None if writer is None else writer.schema)
+
+                    if writer is None:
+                        writer = pq.ParquetWriter(stream, table.schema)
+
+                    writer.write_table(table)
+                    rows += len(Rows)
+
+            finally:
+                if writer is not None:
+                    writer.close()
+
+        else:
+
+            header = True
+
+            for Rows in frames:
+
+                stream.write(Rows.to_csv(index=False, header=header).encode())
+                header = False
+                rows += len(Rows)
+
+    return rows
+
+#Whole minute from local noon the times (in minutes from local noon) fall in
+
+def minute_offsets(minutes):
+
+    return np.clip(np.floor(minutes + 1e-6), 0, 24*60).astype(np.int16)
+
+#Moves the first/last visible time steps of the stars to the actual time the
+#visibility starts/ends: the later of star rise and sunset inside the step
+#before the first visible one, the earlier of star set and sunrise inside
+#the step after the last visible one
+
+def refine_visibility(ra, dec, night, Loc, engine, altitudes, any_visible, first, last):
+
+    elapsed = night.elapsed
+    time_in_local = night.time[0]
+
+    start = elapsed[first]
+    end = elapsed[last]
+
+    def altitude_at(rows):
+        return lambda t: star_altitudes(ra[rows], dec[rows], time_in_local + t*u.min, Loc,
+                                        engine, pairwise=True, epoch=night_epoch(night))
+
+    # start of the visibility
+    rows = np.flatnonzero(any_visible & (first > 0))
+    k = first[rows]-1
+    bound = np.full(len(rows), -np.inf)
+
+    sun_up = night.sun_alt[k] >= 0
+    bound[sun_up] = night.sun_crossings[k[sun_up]]
+
+    star_down = altitudes[k, rows] <= 0
+    if star_down.any():
+        r, kk = rows[star_down], k[star_down]
+        rise = refine_crossings(altitude_at(r), elapsed[kk], elapsed[kk+1],
+                                altitudes[kk, r], altitudes[kk+1, r], night.tolerance)
+        bound[star_down] = np.maximum(bound[star_down], rise)
+
+    start[rows] = bound
+
+    # end of the visibility
+    rows = np.flatnonzero(any_visible & (last < len(elapsed)-1))
+    k = last[rows]
+    bound = np.full(len(rows), np.inf)
+
+    sun_up = night.sun_alt[k+1] >= 0
+    bound[sun_up] = night.sun_crossings[k[sun_up]]
+
+    star_down = altitudes[k+1, rows] <= 0
+    if star_down.any():
+        r, kk = rows[star_down], k[star_down]
+        set_ = refine_crossings(altitude_at(r), elapsed[kk], elapsed[kk+1],
+                                altitudes[kk, r], altitudes[kk+1, r], night.tolerance)
+        bound[star_down] = np.minimum(bound[star_down], set_)
+
+    end[rows] = bound
+
+    return start, end
+
+#Altitude margin in degrees of the geometric classification of the stars,
+#covers the difference between the catalog (ICRS) and the apparent places
+#(precession since J2000, nutation, aberration)
+HORIZON_MARGIN = 1.0
+
+#Sine of the altitudes of the stars at the local sidereal times (in rad),
+#shape (len(sidereal), number of stars), from their catalog places
+
+def approximate_sin_altitudes(ra, dec, sidereal, Loc):
+
+    lat, ra, dec = Loc.lat.rad, np.radians(ra), np.radians(dec)
+
+    return (np.sin(lat)*np.sin(dec)[None, :]
+            + np.cos(lat)*np.cos(dec)[None, :]*np.cos(sidereal[:, None] - ra[None, :]))
+
+#Geometric pre-pass over the stars of a block: -1 for the stars below the
+#horizon during the whole night, 1 for the stars above it during the whole
+#night and 0 for the stars that rise or set in the night, the only ones that
+#need the full transformation. Stars that never rise or never set at the
+#latitude of the site are classified from their declination alone, the
+#others from their hour angle at the time steps of the night (and the steps
+#next to it, used by the rise/set refinement)
+
+def horizon_class(ra, dec, night, Loc, margin=HORIZON_MARGIN):
+
+    lat = Loc.lat.deg
+
+    horizon = np.zeros(len(ra), dtype=np.int8)
+    horizon[90 - np.abs(lat - dec) < -margin] = -1
+    horizon[np.abs(lat + dec) - 90 > margin] = 1
+
+    dark = night.sun_alt < 0
+    steps = dark.copy()
+    steps[1:] |= dark[:-1]
+    steps[:-1] |= dark[1:]
+
+    if not dark.any():
+        horizon[:] = -1
+        return horizon
+
+    rows = np.flatnonzero(horizon == 0)
+
+    if len(rows):
+
+        sin_alt = approximate_sin_altitudes(ra[rows], dec[rows], night.sidereal[steps], Loc)
+
+        sin_margin = np.sin(np.radians(margin))
+
+        horizon[rows[(sin_alt < -sin_margin).all(axis=0)]] = -1
+        horizon[rows[(sin_alt > sin_margin).all(axis=0)]] = 1
+
+    return horizon
+
+#Upper bound (in minutes) of the visibility of the stars, from their
+#approximate altitudes at the time steps of the night: the span of the dark
+#steps where a star can be above the horizon, plus the step on each side
+#the rise/set refinement can move into
+
+def max_durations(ra, dec, night, Loc, margin=HORIZON_MARGIN):
+
+    dark = np.flatnonzero(night.sun_alt < 0)
+
+    if not len(dark) or not len(ra):
+        return np.zeros(len(ra))
+
+    possible = (approximate_sin_altitudes(ra, dec, night.sidereal[dark], Loc)
+                > -np.sin(np.radians(margin)))
+
+    first = possible.argmax(axis=0)
+    last = len(dark) - 1 - possible[::-1].argmax(axis=0)
+
+    step = night.elapsed[1] - night.elapsed[0]
+
+    return np.where(possible.any(axis=0),
+                    night.elapsed[dark[last]] - night.elapsed[dark[first]] + 2*step, 0.0)
+
+#Stars of the catalog brighter than mag_limit, the stars without a valid
+#magnitude (or catalogs without magnitudes) are kept
+
+def magnitude_mask(Data, mag_limit):
+
+    if mag_limit is None or 'mag' not in Data.columns:
+        return np.ones(len(Data), dtype=bool)
+
+    mag = pd.to_numeric(Data['mag'], errors='coerce').to_numpy(dtype=float, na_value=np.nan)
+
+    return np.isnan(mag) | (mag < mag_limit)
+
+#Altitude grid of a block of stars: the computed altitudes of the stars in
+#columns, +90/-90 deg for the other stars, above/below the horizon during
+#the whole night by their class
+
+def fill_altitudes(horizon, columns, altitudes):
+
+    grid = np.empty((len(altitudes), len(horizon)))
+    grid[:] = np.where(horizon > 0, 90.0, -90.0)
+    grid[:, columns] = altitudes
+
+    return grid
+
+#Duration (min), start and end of the observability of one block of stars.
+#Start and end are whole minutes from local noon (night.time_base), -1 when
+#the star is not visible; they are formatted as local times by local_times.
+#With intervals=True the visibility intervals of the stars are returned too
+#(see visibility_runs), stars that set and rise again in the night have
+#several. Only these per-star summaries are returned, the altitude grid of
+#the block is released when the function returns
+
+def Visibility_Block(ra, dec, night, Loc, engine="astropy", altitudes=None, intervals=False):
+
+    # altitudes of the stars (in deg) for the time sequence of frames defined,
+    # computed by the selected engine
+
+    if altitudes is None:
+
+        # only the stars that rise or set in the night are transformed
+        with span("culling", rows=len(ra)):
+            horizon = horizon_class(ra, dec, night, Loc)
+            columns = np.flatnonzero(horizon == 0)
+
+        with span("star transform", rows=len(columns)):
+            Altitudes_local = fill_altitudes(horizon, columns,
+                                             star_altitudes(ra[columns], dec[columns], night.time,
+                                                            Loc, engine))
+    else:
+        Altitudes_local = altitudes
+
+    with span("reduction", rows=len(ra)):
+
+        # star above the horizon while the sun is down, shape (time, stars)
+        visible = (Altitudes_local > 0) & (night.sun_alt < 0)[:, None]
+
+        # first and last visible time index of every star in a single pass
+        any_visible = visible.any(axis=0)
+        first = visible.argmax(axis=0)
+        last = len(visible) - 1 - visible[::-1].argmax(axis=0)
+
+    if not intervals:
+        del visible
+
+    if night.tolerance is None:
+        start = night.elapsed[first]
+        end = night.elapsed[last]
+    else:
+        with span("rise/set refinement", rows=len(ra)):
+            start, end = refine_visibility(ra, dec, night, Loc, engine, Altitudes_local,
+                                           any_visible, first, last)
+
+    #Observabilty Duration
+    Duration_of_Observabilty = np.where(any_visible, end-start, 0.0).astype(np.float32)
+
+    #Time of observability in minutes from local noon
+    start_minute = np.where(any_visible, minute_offsets(start), -1).astype(np.int16)
+    end_minute = np.where(any_visible, minute_offsets(end), -1).astype(np.int16)
+
+    if intervals:
+        with span("visibility intervals", rows=len(ra)):
+            runs = visibility_runs(visible, night.elapsed, start, end)
+
+        return Duration_of_Observabilty, start_minute, end_minute, runs
+
+    return Duration_of_Observabilty, start_minute, end_minute
+
+#Size of the process pool shared by all the calls of the process (all the
+#sessions of the server). The workers of a call are the number of its shards
+#in the pool at once, so one call cannot take the whole pool from the others.
+#Workers are spawned (not forked) as the Streamlit server is multi-threaded,
+#every worker loads the Earth orientation data once when it starts
+
+MAX_WORKERS = max(int(os.environ.get("AVC_MAX_WORKERS", os.cpu_count() or 1)), 1)
+
+PROCESS_POOL = None
+PROCESS_POOL_LOCK = threading.Lock()
+
+def process_pool():
+
+    global PROCESS_POOL
+
+    with PROCESS_POOL_LOCK:
+
+        if PROCESS_POOL is None:
+            PROCESS_POOL = ProcessPoolExecutor(max_workers=MAX_WORKERS,
+                                               mp_context=multiprocessing.get_context("spawn"),
+                                               initializer=earth_orientation.load)
+
+        return PROCESS_POOL
+
+#Number of stars in a block: chunk_size, or without it the catalog split
+#evenly between the workers (the whole catalog for a single process)
+
+def block_size(stars, chunk_size=None, workers=None):
+
+    if chunk_size is not None and int(chunk_size) >= 1:
+        return int(chunk_size)
+
+    return max(-(-stars // max(int(workers or 1), 1)), 1)
+
+#Applies block_function(ra_block, dec_block, *args) to the catalog block by
+#block, in this process or, with more than one worker, as star shards in the
+#shared process pool, at most workers shards of the call at once (the next
+#shard is submitted once the oldest one is done). Yields the index of the
+#first star of every block and its result, always in the order of the catalog
+
+def iter_blocks(block_function, ra, dec, args, chunk_size=None, workers=None):
+
+    step = block_size(len(ra), chunk_size, workers)
+    firsts = range(0, len(ra), step)
+
+    if workers is None or int(workers) < 2 or MAX_WORKERS < 2 or len(firsts) < 2:
+
+        for first in firsts:
+            yield first, block_function(ra[first:first+step], dec[first:first+step], *args)
+
+        return
+
+    pool = process_pool()
+    shards = iter(firsts)
+    pending = deque()
+
+    def submit():
+        first = next(shards, None)
+        if first is not None:
+            pending.append((first, pool.submit(block_function, ra[first:first+step],
+                                               dec[first:first+step], *args)))
+
+    try:
+        for _ in range(min(int(workers), MAX_WORKERS)):
+            submit()
+
+        while pending:
+
+            first, future = pending.popleft()
+
+            # the stages run in the workers, only the wait for the shard is
+            # recorded here (not the work of the caller between the shards)
+            with span("parallel blocks: wait", rows=min(step, len(ra) - first)):
+                result = future.result()
+
+            # the next shard runs while the caller takes this one
+            submit()
+
+            yield first, result
+
+    finally:
+        # the shards not started yet when the caller stops (cancelled job)
+        for _, future in pending:
+            future.cancel()
+
+#Evaluates the catalog block by block, chunk_size stars at a time
+#(the whole catalog at once if chunk_size is None), so the peak memory
+#is set by the chunk size and not by the size of the catalog.
+#Yields the index of the first star of the block and its summaries
+
+def iter_observability(ra, dec, night, Loc, engine="astropy", chunk_size=None, workers=None,
+                       intervals=False):
+
+    yield from iter_blocks(Visibility_Block, ra, dec, (night, Loc, engine, None, intervals),
+                           chunk_size, workers)
+
+#Settings a result depends on, part of the key of the on-disk result cache
+
+def result_settings(dates, utc_shift, Loc, timezone_local, engine, step, tolerance,
+                    mag_limit=None, min_duration=None):
+
+    return dict(dates=[str(date) for date in dates],
+                utc_shift_min=round(float(utc_shift.to_value(u.min)), 3),
+                lat=round(float(Loc.lat.deg), 6),
+                lon=round(float(Loc.lon.deg), 6),
+                height=round(float(Loc.height.to_value(u.m)), 1),
+                timezone=str(timezone_local),
+                engine=engine,
+                step=float(step),
+                tolerance=None if tolerance is None else float(tolerance),
+                mag_limit=None if mag_limit is None else float(mag_limit),
+                min_duration=None if min_duration is None else float(min_duration))
+
+#Row-level memo of the summaries of single stars, so re-running a catalog
+#with a few new or edited stars only computes those. Every context (date,
+#site, engine and time grid) keeps its rows as columns: an index of the
+#(ra, dec) keys packed as complex numbers, the duration, start and end
+#minutes and the intervals (a flat tuple of (start, end) pairs, or None when
+#they were not computed). The columns are never changed in place, a store
+#replaces them, so the lookups run on a snapshot outside the lock. The least
+#recently used contexts, then the oldest rows, are dropped above the limits,
+#ROW_MEMO_ROWS counts the rows of all the contexts
+ROW_MEMO_CONTEXTS = 16
+ROW_MEMO_ROWS = 500_000
+
+ROW_MEMO = OrderedDict()
+ROW_MEMO_LOCK = threading.Lock()
+
+def memo_keys(ra, dec):
+
+    return pd.Index(np.asarray(ra, dtype=np.float64) + 1j*np.asarray(dec, dtype=np.float64))
+
+def empty_memo():
+
+    return (memo_keys([], []), np.zeros(0, dtype=np.float32), np.zeros(0, dtype=np.int16),
+            np.zeros(0, dtype=np.int16), np.empty(0, dtype=object))
+
+def row_memo(settings):
+
+    context = json.dumps(settings, sort_keys=True, default=str)
+
+    with ROW_MEMO_LOCK:
+
+        ROW_MEMO[context] = ROW_MEMO.pop(context, None) or empty_memo()
+
+        while len(ROW_MEMO) > ROW_MEMO_CONTEXTS:
+            ROW_MEMO.popitem(last=False)
+
+    return context
+
+#Summaries (and intervals) of the stars found in the memo of a context, and
+#the indices of the missing stars. With intervals=True the stars memoized
+#without their intervals are missing
+
+def memo_lookup(context, ra, dec, intervals=False):
+
+    with ROW_MEMO_LOCK:
+        keys, duration, start, end, runs = ROW_MEMO.get(context) or empty_memo()
+
+    found = keys.get_indexer(memo_keys(ra, dec))
+    hit = found >= 0
+
+    if intervals:
+        hit[hit] = np.not_equal(runs[found[hit]], None)
+
+    rows = found[hit]
+
+    star_duration = np.zeros(len(ra), dtype=np.float32)
+    star_start = np.full(len(ra), -1, dtype=np.int16)
+    star_end = np.full(len(ra), -1, dtype=np.int16)
+    star_runs = np.empty(len(ra), dtype=object)
+    star_runs.fill(())
+
+    star_duration[hit] = duration[rows]
+    star_start[hit] = start[rows]
+    star_end[hit] = end[rows]
+    star_runs[hit] = runs[rows]
+
+    return star_duration, star_start, star_end, star_runs.tolist(), np.flatnonzero(~hit)
+
+#The rows of a store replace the memoized rows of the same stars
+
+def memo_store(context, ra, dec, duration, start, end, runs=None):
+
+    new_keys = memo_keys(ra, dec)
+    new_runs = np.fromiter([None]*len(ra) if runs is None else runs, dtype=object, count=len(ra))
+
+    # the last of the duplicated stars of the catalog is kept
+    unique = ~new_keys.duplicated(keep="last")
+
+    with ROW_MEMO_LOCK:
+
+        keys, *columns = ROW_MEMO.get(context) or empty_memo()
+
+        kept = ~keys.isin(new_keys)
+        keys = keys[kept].append(new_keys[unique])
+        columns = [np.concatenate((column[kept], new[unique]))
+                   for column, new in zip(columns, (np.asarray(duration, dtype=np.float32),
+                                                    np.asarray(start, dtype=np.int16),
+                                                    np.asarray(end, dtype=np.int16), new_runs))]
+
+        if len(keys) > ROW_MEMO_ROWS:
+            keys = keys[-ROW_MEMO_ROWS:]
+            columns = [column[-ROW_MEMO_ROWS:] for column in columns]
+
+        ROW_MEMO.pop(context, None)
+        ROW_MEMO[context] = (keys, *columns)
+
+        total = sum(len(memo[0]) for memo in ROW_MEMO.values())
+
+        while total > ROW_MEMO_ROWS:
+            total -= len(ROW_MEMO.popitem(last=False)[1][0])
+
+#Flat tuples of (start, end) pairs of the intervals of every star of a block,
+#from the star (column), start and end of every interval
+
+def star_runs(stars, run_start, run_end, count):
+
+    bounds = np.searchsorted(stars, np.arange(count+1))
+    flat = np.column_stack((run_start, run_end)).ravel().tolist()
+
+    return [tuple(flat[2*a:2*b]) for a, b in zip(bounds[:-1], bounds[1:])]
+
+#Interval index of a result from the intervals of its stars (in row order)
+
+def interval_index(runs):
+
+    counts = np.fromiter((len(r)//2 for r in runs), dtype=np.int64, count=len(runs))
+    flat = np.fromiter(chain.from_iterable(runs), dtype=np.float32, count=2*int(counts.sum()))
+
+    return VisibilityIndex(np.repeat(np.arange(len(runs)), counts), flat[0::2], flat[1::2])
+
+#Rows of the catalog with the summaries of a block of stars, for the
+#progress of a calculation
+
+def block_rows(Data, rows, duration, start, end, min_duration=None):
+
+    Block = Data.iloc[rows].assign(**{'Visibility (min)': duration,
+                                      'Visibility (start)': start,
+                                      'Visibility (end)': end})
+
+    if min_duration is not None:
+        Block = Block[Block['Visibility (min)'] > min_duration]
+
+    return Block
+
+#step is the time step of the grid in minutes, with a tolerance (in minutes)
+#the rise/set of the stars and the sun are refined inside the steps.
+#Visibility windows shorter than the step can be missed by the coarse grid.
+#With workers > 1 the blocks are computed in parallel processes.
+#Results are kept in the in-memory result cache, and in the on-disk one when
+#a cache directory is given (or set by AVC_CACHE_DIR).
+#Only the stars brighter than mag_limit and visible for longer than
+#min_duration (in minutes) are returned. The magnitude cut is made before
+#any coordinate work, the stars that cannot be visible long enough by their
+#geometry are dropped before the transformation.
+#Stars already computed with the same date, site and settings are taken from
+#the row memo, only the new ones are computed.
+#progress(Block, done) is called with the rows of every block as soon as it
+#is computed (the stars from the memo first) and the fraction of the stars done.
+#With intervals=True the VisibilityIndex of the visibility intervals of the
+#stars (by row of the result) is returned with the result
+
+def Observability(Data, _utc_shift,date, _Loc, timezone_local, engine="astropy", chunk_size=None,
+                  step=5, tolerance=None, workers=None, cache_dir=None, mag_limit=None,
+                  min_duration=None, progress=None, intervals=False):
+
+    settings = result_settings([date], _utc_shift, _Loc, timezone_local, engine, step, tolerance,
+                               mag_limit, min_duration)
+
+    key = result_cache.cache_key(result_cache.catalog_fingerprint(Data), **settings)
+    intervals_key = result_cache.cache_key(key, intervals=True)
+
+    Result = result_cache.load(key, cache_dir)
+
+    if Result is not None and not intervals:
+        return Result
+
+    Intervals = result_cache.load(intervals_key, cache_dir) if Result is not None else None
+
+    if Intervals is not None:
+        return Result, VisibilityIndex(Intervals['row'], Intervals['start'], Intervals['end'])
+
+    keep = magnitude_mask(Data, mag_limit)
+
+    night = Night_Grid(date, _utc_shift, _Loc, timezone_local, step, tolerance)
+
+    if min_duration is not None:
+        with span("duration bound", rows=int(keep.sum())):
+            rows = np.flatnonzero(keep)
+            keep[rows] = max_durations(Data['ra'].values[rows].astype(float),
+                                       Data['dec'].values[rows].astype(float),
+                                       night, _Loc) > min_duration
+
+    # the result is a new frame, the catalog is never modified (a shallow
+    # copy shares its columns until they are written)
+    Data = Data[keep] if not keep.all() else Data.copy(deep=False)
+
+    ra = Data['ra'].values.astype(float)
+    dec = Data['dec'].values.astype(float)
+
+    if engine == "fast":
+        with span("fast engine error"):
+            Data.attrs['max_altitude_error'] = fast_altitude_error(ra, dec, night.time, _Loc)
+
+    Data.attrs.update(time_base_attrs(night, date))
+
+    context = row_memo(result_settings([date], _utc_shift, _Loc, timezone_local, engine, step, tolerance))
+
+    with span("row memo", rows=len(ra)):
+        Duration_of_Observabilty, start_minute, end_minute, runs, missing = memo_lookup(context, ra, dec,
+                                                                                       intervals)
+
+    if progress is not None and len(missing) < len(ra):
+        rows = np.setdiff1d(np.arange(len(ra)), missing)
+        progress(block_rows(Data, rows, Duration_of_Observabilty[rows], start_minute[rows],
+                            end_minute[rows], min_duration),
+                 len(rows)/len(ra))
+
+    for first, (duration, start, end, *block_runs) in iter_observability(ra[missing], dec[missing],
+                                                                         night, _Loc, engine,
+                                                                         chunk_size, workers, intervals):
+        rows = missing[first:first+len(duration)]
+
+        Duration_of_Observabilty[rows] = duration
+        start_minute[rows] = start
+        end_minute[rows] = end
+
+        if intervals:
+            for row, star in zip(rows, star_runs(*block_runs[0], len(rows))):
+                runs[row] = star
+
+        if progress is not None:
+            progress(block_rows(Data, rows, duration, start, end, min_duration),
+                     (len(ra) - len(missing) + first + len(duration))/len(ra))
+
+    memo_store(context, ra[missing], dec[missing], Duration_of_Observabilty[missing],
+               start_minute[missing], end_minute[missing],
+               [runs[row] for row in missing] if intervals else None)
+
+    Data['Visibility (min)'] = Duration_of_Observabilty
+    Data['Visibility (start)'] = start_minute
+    Data['Visibility (end)'] = end_minute
+
+    if min_duration is not None:
+        longer = Duration_of_Observabilty > min_duration
+        Data = Data[longer]
+        runs = [runs[row] for row in np.flatnonzero(longer)]
+
+    result_cache.store(key, Data, cache_dir)
+
+    if not intervals:
+        return Data
+
+    with span("interval index", rows=len(Data)):
+        Index = interval_index(runs)
+
+    result_cache.store(intervals_key, pd.DataFrame({'row': Index.rows, 'start': Index.start,
+                                                    'end': Index.end}), cache_dir)
+
+    return Data, Index
+
+#Longest date range (in nights) of Observability_Range
+MAX_RANGE_NIGHTS = 366
+
+#Number of cells (time steps x stars) of the altitude grid evaluated at once
+#when several nights are batched on one time axis
+RANGE_BATCH_CELLS = 2_000_000
+
+#Summaries of one block of stars for every night in nights, batching as
+#many nights on one time axis as fit in RANGE_BATCH_CELLS. With the fast
+#engine the apparent places of the stars are computed for the epoch of every
+#night (in one broadcast per batch), so the summaries of a night are the ones
+#of Observability for its date whatever the chunk size or the workers.
+#With min_duration (in minutes) the visibility of every star is bounded by
+#its geometry night by night: the stars that cannot be visible for longer
+#on any night are not computed, the others only on the nights they can be
+#(the durations of the other nights are left below min_duration).
+#Returns arrays of shape (stars of the block, nights)
+
+def Range_Block(ra, dec, nights, Loc, engine="astropy", min_duration=None):
+
+    steps = len(nights[0].time)
+
+    duration = np.zeros((len(ra), len(nights)), dtype=np.float32)
+    start = np.full((len(ra), len(nights)), -1, dtype=np.int16)
+    end = np.full((len(ra), len(nights)), -1, dtype=np.int16)
+
+    stars = np.arange(len(ra))
+    possible = None
+
+    if min_duration is not None:
+
+        with span("duration bound", rows=len(ra)*len(nights)):
+            possible = np.column_stack([max_durations(ra, dec, night, Loc) > min_duration
+                                        for night in nights]).reshape(len(ra), len(nights))
+
+        stars = np.flatnonzero(possible.any(axis=1))
+        possible = possible[stars]
+
+        if not len(stars):
+            return duration, start, end
+
+        ra, dec = ra[stars], dec[stars]
+
+    batch = max(RANGE_BATCH_CELLS // (steps*max(len(ra), 1)), 1)
+
+    for n in range(0, len(nights), batch):
+
+        batch_nights = nights[n:n+batch]
+
+        # only the stars that rise or set in one of the nights (and can be
+        # visible long enough that night) are transformed
+        with span("culling", rows=len(ra)*len(batch_nights)):
+            horizon = [horizon_class(ra, dec, night, Loc) for night in batch_nights]
+
+            if possible is not None:
+                for i, night_horizon in enumerate(horizon):
+                    night_horizon[~possible[:, n+i]] = -1
+
+            columns = np.flatnonzero(np.any([h == 0 for h in horizon], axis=0))
+
+        with span("star transform", rows=len(columns)*len(batch_nights)):
+            altitudes = nights_altitudes(ra[columns], dec[columns], batch_nights, Loc, engine)
+
+        for i, night in enumerate(batch_nights):
+
+            duration[stars, n+i], start[stars, n+i], end[stars, n+i] = Visibility_Block(
+                ra, dec, night, Loc, engine, altitudes=fill_altitudes(horizon[i], columns, altitudes[i]))
+
+    return duration, start, end
+
+#Evaluates the catalog block by block for every night in nights.
+#Yields the index of the first star of the block and its summaries
+
+def iter_range_observability(ra, dec, nights, Loc, engine="astropy", chunk_size=None, workers=None,
+                             min_duration=None):
+
+    yield from iter_blocks(Range_Block, ra, dec, (nights, Loc, engine, min_duration), chunk_size,
+                           workers)
+
+#Nights from start_date to end_date (at most MAX_RANGE_NIGHTS)
+
+def Range_Nights(start_date, end_date, utc_shift, Loc, timezone_local, step=5, tolerance=None):
+
+    nights_count = (end_date - start_date).days + 1
+
+    if nights_count < 1:
+        raise ValueError('The end date must not be before the start date')
+
+    if nights_count > MAX_RANGE_NIGHTS:
+        raise ValueError(f'The date range is limited to {MAX_RANGE_NIGHTS} nights')
+
+    return build_nights(start_date, nights_count, round(float(utc_shift.to_value(u.min)), 3),
+                        Loc, timezone_local, float(step),
+                        None if tolerance is None else float(tolerance))
+
+#Rows of a block of stars, one per star and night (star by star)
+
+def range_rows(Block, dates, duration, start, end):
+
+    Rows = Block.iloc[np.repeat(np.arange(len(Block)), len(dates))].reset_index(drop=True)
+
+    Rows.insert(len(Block.columns), 'date', np.tile(np.array(dates, dtype=object), len(Block)))
+
+    Rows['Visibility (min)'] = duration.ravel()
+    Rows['Visibility (start)'] = start.ravel()
+    Rows['Visibility (end)'] = end.ravel()
+
+    return Rows
+
+#Evaluates the catalog for every night, yields the index of the first star
+#of every block and the rows of the block as soon as it is computed.
+#With min_duration (in minutes) only the rows of the nights the star is
+#visible for longer are kept
+
+def iter_range_frames(Data, nights, start_date, Loc, engine="astropy", chunk_size=None, workers=None,
+                      min_duration=None):
+
+    ra = Data['ra'].values.astype(float)
+    dec = Data['dec'].values.astype(float)
+
+    dates = [start_date + datetime.timedelta(days=n) for n in range(len(nights))]
+
+    for first, (duration, start, end) in iter_range_observability(ra, dec, nights, Loc, engine,
+                                                                  chunk_size, workers, min_duration):
+
+        Rows = range_rows(Data.iloc[first:first+len(duration)], dates, duration, start, end)
+        Rows.attrs.update(time_base_attrs(nights[0], start_date))
+
+        if min_duration is not None:
+            Rows = Rows[Rows['Visibility (min)'] > min_duration].reset_index(drop=True)
+
+        yield first, Rows
+
+#Observability of the catalog for every night from start_date to end_date
+#(at most MAX_RANGE_NIGHTS nights), one row per star and night. The filters
+#are the ones of Observability, the duration applies to every night.
+#progress(Rows, done) is called with the rows of every block of stars as
+#soon as they are computed and the fraction of the stars done
+
+def Observability_Range(Data, _utc_shift, start_date, end_date, _Loc, timezone_local,
+                        engine="astropy", chunk_size=None, step=5, tolerance=None, workers=None,
+                        cache_dir=None, mag_limit=None, min_duration=None, progress=None):
+
+    key = result_cache.cache_key(result_cache.catalog_fingerprint(Data),
+                                 **result_settings([start_date, end_date], _utc_shift, _Loc,
+                                                   timezone_local, engine, step, tolerance,
+                                                   mag_limit, min_duration))
+
+    Result = result_cache.load(key, cache_dir)
+
+    if Result is not None:
+        return Result
+
+    keep = magnitude_mask(Data, mag_limit)
+
+    if not keep.all():
+        Data = Data[keep]
+
+    nights = Range_Nights(start_date, end_date, _utc_shift, _Loc, timezone_local, step, tolerance)
+
+    frames = []
+
+    for first, Rows in iter_range_frames(Data, nights, start_date, _Loc,
+                                         engine, chunk_size, workers, min_duration):
+        frames.append(Rows)
+
+        if progress is not None:
+            progress(Rows, min(first + block_size(len(Data), chunk_size, workers), len(Data))/len(Data))
+
+    if frames:
+        Result = pd.concat(frames, ignore_index=True)
+    else:
+        empty = np.zeros((0, len(nights)), dtype=np.int16)
+        Result = range_rows(Data, [start_date + datetime.timedelta(days=n) for n in range(len(nights))],
+                            empty.astype(np.float32), empty, empty)
+
+    Result.attrs = dict(Data.attrs, **time_base_attrs(nights[0], start_date))
+
+    if engine == "fast":
+        with span("fast engine error", rows=len(Data)):
+            Result.attrs['max_altitude_error'] = fast_nights_error(Data['ra'].values.astype(float),
+                                                                   Data['dec'].values.astype(float),
+                                                                   nights, _Loc)
+
+    result_cache.store(key, Result, cache_dir)
+
+    return Result
+
+#Summaries of one block of stars at every site, one night per site (on the
+#same grid of time steps). With the fast engine the apparent places of the
+#stars are computed once for all the sites and the altitudes are a single
+#broadcast over the site dimension; with astropy every site is transformed
+#(after its own culling). Returns arrays of shape (stars of the block, sites)
+
+def Sites_Block(ra, dec, nights, Locs, engine="astropy"):
+
+    duration = np.zeros((len(ra), len(nights)), dtype=np.float32)
+    start = np.full((len(ra), len(nights)), -1, dtype=np.int16)
+    end = np.full((len(ra), len(nights)), -1, dtype=np.int16)
+
+    altitudes = repeat(None)
+
+    if engine == "fast":
+
+        # the apparent places change by well under an arcsecond between the
+        # nights of the sites, they are computed at the middle of the first one
+        with span("star transform", rows=len(ra)):
+            apparent = SkyCoord(ra=ra*u.deg, dec=dec*u.deg).transform_to(
+                TETE(obstime=nights[0].time[len(nights[0].time)//2]))
+
+        with span("site broadcast", rows=len(ra)*len(nights)):
+            altitudes = hour_angle_altitudes(apparent.ra.rad, apparent.dec.rad,
+                                             np.stack([night.sidereal for night in nights])[:, :, None],
+                                             np.array([Loc.lat.rad for Loc in Locs])[:, None, None])
+
+    for i, (night, Loc, site_altitudes) in enumerate(zip(nights, Locs, altitudes)):
+
+        duration[:, i], start[:, i], end[:, i] = Visibility_Block(ra, dec, night, Loc, engine,
+                                                                  altitudes=site_altitudes)
+
+    return duration, start, end
+
+#Observability of the catalog at every site for the night of date, one row per
+#site and star (site by site). sites is a list of (name, Loc, timezone_local,
+#utc_shift); the catalog, its filters and the star vectors are shared by the
+#sites and the stars are computed in blocks for all the sites at once.
+#A site without night time has every star not visible
+
+def Observability_Sites(Data, sites, date, engine="astropy", chunk_size=None, step=5, tolerance=None,
+                        workers=None, mag_limit=None, min_duration=None):
+
+    names = [str(name) for name, *_ in sites]
+
+    if len(set(names)) != len(names):
+        raise ValueError('The names of the sites must be unique')
+
+    keep = magnitude_mask(Data, mag_limit)
+
+    if not keep.all():
+        Data = Data[keep]
+
+    nights = [Night_Grid(date, utc_shift, Loc, timezone_local, step, tolerance, require_night=False)
+              for name, Loc, timezone_local, utc_shift in sites]
+    Locs = [Loc for name, Loc, timezone_local, utc_shift in sites]
+
+    ra = Data['ra'].values.astype(float)
+    dec = Data['dec'].values.astype(float)
+
+    duration = np.zeros((len(ra), len(sites)), dtype=np.float32)
+    start = np.full((len(ra), len(sites)), -1, dtype=np.int16)
+    end = np.full((len(ra), len(sites)), -1, dtype=np.int16)
+
+    for first, (block_duration, block_start, block_end) in iter_blocks(Sites_Block, ra, dec,
+                                                                       (nights, Locs, engine),
+                                                                       chunk_size, workers):
+        rows = slice(first, first+len(block_duration))
+
+        duration[rows], start[rows], end[rows] = block_duration, block_start, block_end
+
+    frames = []
+
+    for i, name in enumerate(names):
+
+        Rows = Data.copy(deep=False)
+        Rows.insert(0, 'site', name)
+        Rows['Visibility (min)'] = duration[:, i]
+        Rows['Visibility (start)'] = start[:, i]
+        Rows['Visibility (end)'] = end[:, i]
+
+        if min_duration is not None:
+            Rows = Rows[Rows['Visibility (min)'] > min_duration]
+
+        frames.append(Rows)
+
+    Result = pd.concat(frames, ignore_index=True)
+
+    Result.attrs = dict(Data.attrs, sites={name: time_base_attrs(night, date)
+                                           for name, night in zip(names, nights)})
+
+    if engine == "fast":
+        Result.attrs['max_altitude_error'] = max(fast_altitude_error(ra, dec, night.time, Loc)
+                                                 for night, Loc in zip(nights, Locs))
+
+    return Result
+
+#Visibility of one star: the duration, the local rise/set labels and the
+#altitude curves of the star and of the sun over the night (one row per
+#time step, the star at night is NaN while the sun is up)
+
+def Single_Star_Night(ra, dec, _utc_shift, date, _Loc, timezone_local, step=5, tolerance=None):
+
+    night = Night_Grid(date, _utc_shift, _Loc, timezone_local, step, tolerance)
+
+    # transforms the declination and right ascension of the
+    # star into altitudes for the time sequence defined
+
+    Altitudes_local = star_altitudes(np.array([float(ra)]), np.array([float(dec)]), night.time, _Loc)
+
+    duration, start, end = Visibility_Block(np.array([float(ra)]), np.array([float(dec)]), night, _Loc,
+                                            altitudes=Altitudes_local)
+
+    Altitudes_local = Altitudes_local[:, 0]
+
+    #Time of observability in Local timezone
+
+    formatted=[]
+
+    if start[0] >= 0:
+        formatted.extend(str(label) for label in local_times([start[0], end[0]], night.time_base,
+                                                             night.timezone))
+    else:
+        formatted.append("Not Visibile")
+
+    Curves = pd.DataFrame({
+        'Time from noon [h]': night.elapsed/60,
+        'Sun': night.sun_alt,
+        'Star (daylight)': Altitudes_local,
+        'Star (night)': np.where(night.sun_alt < 0, Altitudes_local, np.nan),
+    })
+
+    #Observabilty Duration
+    return duration[0], formatted, Curves
+
+#Altitude chart of a star from its curves, on a figure of its own (not the
+#pyplot state machine), so charts can be drawn by several sessions at once
+
+def altitude_figure(Curves):
+
+    # matplotlib is only loaded with the first chart, the other pages and the
+    # worker processes start without it
+    from matplotlib.figure import Figure
+
+    fig = Figure()
+    ax = fig.subplots()
+
+    hours = Curves['Time from noon [h]']
+
+    ax.plot(hours, Curves['Sun'], color='orange', label='Sun')
+    ax.plot(hours, Curves['Star (daylight)'], color='red', linestyle=':', label='Star (daylight)')
+    ax.plot(hours, Curves['Star (night)'], color='red', label='Star (night)')
+
+    ax.set_xlabel('Time from noon [h]')
+    ax.set_xlim(0, 24)
+    ax.set_xticks(np.arange(13)*2)
+    ax.set_ylim(0,90)
+    ax.set_ylabel('Altitude [deg]')
+    ax.legend(loc='best')
+    ax.set_title("Altitude vs Time")
+
+    return fig
+
+#PNG of a figure, as shown by st.pyplot
+
+def figure_png(fig):
+
+    buffer = io.BytesIO()
+    fig.savefig(buffer, format="png", dpi=200, bbox_inches="tight")
+
+    return buffer.getvalue()
+
+#Curves with at most points rows (every n-th time step, the last one kept)
+#for a light chart drawn in the browser
+
+CHART_POINTS = 145
+
+def downsample(Curves, points=CHART_POINTS):
+
+    every = max(-(-len(Curves) // points), 1)
+
+    rows = np.unique(np.r_[np.arange(0, len(Curves), every), len(Curves) - 1])
+
+    return Curves.iloc[rows].reset_index(drop=True)
+
+def Observability_Single(ra, dec, _utc_shift,date, _Loc, timezone_local, step=5, tolerance=None):
+
+    Duration_of_Observabilty, formatted, Curves = Single_Star_Night(ra, dec, _utc_shift, date, _Loc,
+                                                                     timezone_local, step, tolerance)
+
+    return Duration_of_Observabilty, formatted, altitude_figure(Curves)
+
+#Timezone finder shared by all the calls, its polygon data is loaded once per
+#process, on the first lookup
+
+TIMEZONE_FINDER = None
+TIMEZONE_FINDER_LOCK = threading.Lock()
+
+def timezone_finder():
+
+    global TIMEZONE_FINDER
+
+    with TIMEZONE_FINDER_LOCK:
+
+        if TIMEZONE_FINDER is None:
+
+            from timezonefinder import TimezoneFinder
+
+            TIMEZONE_FINDER = TimezoneFinder()
+
+        return TIMEZONE_FINDER
+
+def Coordinates(lat, long):
+    if is_numeric(lat) and is_numeric(long):
+
+        try:
+
+            tf = timezone_finder()
+            Loc = EarthLocation(lat=float(lat), lon=float(long))
+            tz_string = tf.timezone_at(lat=Loc.lat.deg, lng=Loc.lon.deg)
+            timezone_local = ZoneInfo(tz_string)
+
+            return Loc, timezone_local, tz_string
+
+        except Exception as e:
+            raise ValueError('Please enter valid latitude and longitude')
+    else:
+        raise ValueError('Please enter valid latitude and longitude')
\ No newline at end of file